@@ -28,6 +28,8 @@ pythonPackages.buildPythonApplication rec {
     ed25519
     boto3
     pyyaml
+    orjson
+    uvloop
     mypy
     cython
     opendht
@@ -12,9 +12,13 @@ Date: 1.5.2024
 from typing import Optional, List
 
 from cache_server_app.src.database import CacheServerDatabase
+from cache_server_app.src.lru import LRUCache
 from cache_server_app.src.types import AgentRow
 from cache_server_app.src.workspace import Workspace
 
+AGENT_CACHE_SIZE = 256
+AGENT_CACHE_TTL = 60 # seconds
+
 
 class Agent:
     """
@@ -28,6 +32,9 @@ class Agent:
         workspace: object representing workspace to which agent belongs
     """
 
+    # agents looked up by name, shared by HTTP and WebSocket handlers
+    _by_name: LRUCache["Agent"] = LRUCache(AGENT_CACHE_SIZE, AGENT_CACHE_TTL)
+
     def __init__(self, id: str, name: str, token: str, workspace: Workspace) -> None:
         self.database = CacheServerDatabase()
         self.id = id
@@ -36,11 +43,25 @@ class Agent:
         self.workspace = workspace
 
     @staticmethod
-    def get_rows() -> List[AgentRow]:
+    def get_rows(names: Optional[List[str]] = None) -> List[AgentRow]:
+        if names is not None:
+            return CacheServerDatabase().get_agent_rows(names)
         return CacheServerDatabase().get_agents()
 
     @staticmethod
     def get(id: str | None = None, name : str | None = None) -> Optional['Agent']:
+        if name and not id:
+            agent = Agent._by_name.get(name)
+            if agent is None:
+                agent = Agent._get(name=name)
+                if agent:
+                    Agent._by_name.put(name, agent)
+            return agent
+
+        return Agent._get(id, name)
+
+    @staticmethod
+    def _get(id: str | None = None, name : str | None = None) -> Optional['Agent']:
         row = CacheServerDatabase().get_agent_row(id, name)
         if not row:
             return None
@@ -52,10 +73,13 @@ class Agent:
         return Agent(row[0], row[1], row[2], workspace)
 
     def save(self) -> None:
+        Agent._by_name.clear()
         self.database.insert_agent(self.id, self.name, self.token, self.workspace.id)
 
     def delete(self) -> None:
+        Agent._by_name.clear()
         self.database.delete_agent(self.name)
 
     def update(self) -> None:
+        Agent._by_name.clear()
         self.database.update_agent(self.id, self.name, self.token, self.workspace.id)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3.12
+"""
+base
+
+Module containing the base HTTP request handler shared by cache-server APIs.
+
+Author: Radim Mifka
+
+Date: 16.10.2026
+"""
+
+import hmac
+import io
+import re
+import shutil
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, BinaryIO, Callable, Dict, Optional, Sequence, Tuple, TypeAlias, cast
+
+from cache_server_app.src.api.constants import IDLE_TIMEOUT, REQUEST_QUEUE_SIZE, WRITE_BUFFER_SIZE
+from cache_server_app.src.storage.constants import CHUNK_SIZE
+
+Routes: TypeAlias = Sequence[Tuple[re.Pattern[str], Callable[[Any, re.Match[str]], Any]]]  # pattern -> handler(self, match)
+
+
+def credentials(authorization: Optional[str]) -> str:
+    """Get the credentials from an Authorization header value ("<scheme> <credentials>")."""
+    if not authorization:
+        return ""
+    i = authorization.find(" ")
+    return authorization[i + 1:] if i >= 0 else ""
+
+
+def valid_token(given: str | bytes, token: str) -> bool:
+    """Compare a token from a request with the expected one in constant time."""
+    if isinstance(given, str):
+        given = given.encode("utf-8")
+    return hmac.compare_digest(given, token.encode("utf-8"))
+
+
+class HTTPServer(ThreadingHTTPServer):
+    """
+    Base class for cache-server HTTP servers.
+
+    Each request is handled in its own daemon thread.
+    """
+
+    # bursts of clients opening keep-alive connections shouldn't be refused
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Base class for cache-server HTTP request handlers.
+
+    Handlers speak HTTP/1.1 so that clients (Nix, cachix, DHT clients) can
+    reuse one connection for many requests. Persistent connections require
+    every response to carry Content-Length, so responses should be sent
+    through send_body.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    # every connection holds a thread, close persistent connections that went
+    # silent instead of waiting for the client forever
+    timeout = IDLE_TIMEOUT
+
+    # buffer writes so headers and a small body leave in one send(),
+    # the buffer is flushed after every handled request
+    wbufsize = WRITE_BUFFER_SIZE
+
+    def setup(self) -> None:
+        super().setup()
+        # small responses shouldn't wait for delayed ACKs, dead keep-alive peers get detected
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def parse_request(self) -> bool:
+        self.body_read = False
+        return super().parse_request()
+
+    def dispatch(self, routes: Routes) -> Any:
+        """Call the handler registered for the request path.
+
+        The patterns in routes are tried in order. Responds with 400 if no
+        route matches.
+
+        Returns:
+            Any: value returned by the handler, None if no route matched
+        """
+        for pattern, handler in routes:
+            if m := pattern.match(self.path):
+                return handler(self, m)
+
+        self.send_body(400)
+        return None
+
+    def content_length(self) -> int:
+        """Get the length of the request body."""
+        return int(self.headers.get("Content-Length", 0))
+
+    def read_body(self) -> bytes:
+        """Read the whole request body."""
+        self.body_read = True
+        return self.rfile.read(self.content_length())
+
+    def body_stream(self) -> Tuple[BinaryIO, int]:
+        """Get the request body as a stream, the caller must consume it whole.
+
+        Returns:
+            Tuple[BinaryIO, int]: stream of the body and its length
+        """
+        self.body_read = True
+        # rfile is a buffered binary reader, storages only need its read()
+        return cast(BinaryIO, self.rfile), self.content_length()
+
+    def has_unread_body(self) -> bool:
+        """Check if the request body was left unread in the connection."""
+        return not self.body_read and self.content_length() > 0
+
+    def send_body(
+        self,
+        status: int,
+        body: bytes = b"",
+        content_type: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Send a complete response with the given status and body.
+
+        Args:
+            status: HTTP status code
+            body: response body
+            content_type: value of the Content-Type header, if any
+            headers: additional headers to send
+        """
+        self.send_headers(status, len(body), content_type, headers)
+        if body:
+            self.wfile.write(body)
+
+    def send_stream(
+        self,
+        status: int,
+        stream: BinaryIO,
+        length: int,
+        content_type: Optional[str] = None,
+    ) -> None:
+        """Send a response with the body copied from a stream in chunks.
+
+        Args:
+            status: HTTP status code
+            stream: stream to read the body from
+            length: length of the body in bytes
+            content_type: value of the Content-Type header, if any
+        """
+        self.send_headers(status, length, content_type)
+
+        if isinstance(stream, io.BufferedReader):
+            # regular file, let the kernel copy it to the socket
+            self.wfile.flush()
+            self.connection.sendfile(stream, count=length)
+        else:
+            shutil.copyfileobj(stream, self.wfile, CHUNK_SIZE)
+
+    def send_headers(
+        self,
+        status: int,
+        length: int,
+        content_type: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Send the status line and headers of a response."""
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+
+        # unread body would be parsed as the next request, drop the connection
+        if self.has_unread_body():
+            self.send_header("Connection", "close")
+
+        self.end_headers()
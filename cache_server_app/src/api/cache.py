@@ -10,22 +10,59 @@ Date: 17.4.2025
 """
 
 import base64
+import hmac
 import re
-from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from typing import Tuple, Any
+import string
+from typing import Any, List, Optional, Tuple
 import time
 
+from cache_server_app.src.api.constants import (
+    BINARY_CONTENT_TYPE,
+    COMPRESSIONS,
+    NARINFO_CACHE_SIZE,
+    NARINFO_CACHE_TTL,
+    NARINFO_CONTENT_TYPE,
+    NARINFO_MISS_CACHE_SIZE,
+    NARINFO_MISS_CACHE_TTL,
+)
+from cache_server_app.src.api.base import HTTPServer, RequestHandler, Routes
 from cache_server_app.src.cache.base import BinaryCache
 from cache_server_app.src.cache.remote import RemoteCacheHelper
 from cache_server_app.src.store_path import StorePath
+from cache_server_app.src.lru import LRUCache
 
-class HTTPBinaryCache(ThreadingHTTPServer):
+NIX_CACHE_INFO = b"Priority: 30\nStoreDir: /nix/store\nWantMassQuery: 1\n"
+
+HASH_CHARS = frozenset(string.ascii_lowercase + string.digits)
+
+NAR_UPLOAD_RE = re.compile(r"^/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})$")
+NARINFO_HEAD_RE = re.compile(r"^\/([a-z0-9]+)\.narinfo")
+
+def is_hash(value: str) -> bool:
+    """Check if the value is a non-empty string of lowercase letters and digits."""
+    return bool(value) and HASH_CHARS.issuperset(value)
+
+class HTTPBinaryCache(HTTPServer):
     def __init__(self, server_address: Tuple[str, int], request_handler: type["BinaryCacheRequestHandler"], cache: BinaryCache) -> None:
         super().__init__(server_address, request_handler)
         self.cache = cache
         self.remote = RemoteCacheHelper(cache)
-
-class BinaryCacheRequestHandler(BaseHTTPRequestHandler):
+        # narinfo of store paths of this cache: store hash -> (narinfo, served from this cache)
+        self.narinfos: LRUCache[Tuple[bytes, bool]] = LRUCache(NARINFO_CACHE_SIZE, NARINFO_CACHE_TTL)
+        # store hashes found neither locally nor in a remote cache, spares repeated DHT probes
+        self.missing_narinfos: LRUCache[bool] = LRUCache(NARINFO_MISS_CACHE_SIZE, NARINFO_MISS_CACHE_TTL)
+        # Nix sends basic auth with an empty user name, ":<token>"
+        self.authorization = b"Basic " + base64.b64encode(b":" + cache.token.encode("utf-8"))
+        # garbage collection runs in this process, don't serve narinfo of removed paths
+        cache.removed_listeners.append(self.forget_store_paths)
+
+    def forget_store_paths(self, store_hashes: List[str]) -> None:
+        """Drop memoized lookups and narinfo of store paths removed from the cache."""
+        StorePath.clear_lookups()
+        for store_hash in store_hashes:
+            self.narinfos.invalidate(store_hash)
+
+class BinaryCacheRequestHandler(RequestHandler):
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
@@ -33,253 +70,218 @@ class BinaryCacheRequestHandler(BaseHTTPRequestHandler):
 
     """
     Class to handle binary cache HTTP requests.
+
+    Route handlers return True if the request was served from this cache,
+    the do_* methods record it together with the response time.
     """
     def do_GET(self) -> None:
-        start_time = time.time()
+        start_time = time.perf_counter()
 
-        if self.server.cache.is_private():
-            if (
-                base64.b64decode(self.headers["Authorization"].split()[1]).decode(
-                    "utf-8"
-                )[1:]
-                != self.server.cache.token
-            ):
-                self.send_response(401)
-                self.end_headers()
-                return
-
-        # /nix-cache-info
-        if m := re.match(r"^/nix-cache-info$", self.path):
-            cache_info = "Priority: 30\nStoreDir: /nix/store\nWantMassQuery: 1\n".encode(
-                "utf-8"
-            )
-            self.send_response(200)
-            self.send_header("Content-Type", "application/octet-stream")
-            self.send_header("Content-Length", str(len(cache_info)))
-            self.end_headers()
-            self.wfile.write(cache_info)
-
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(True, response_time)
+        if not self.authorize():
             return
 
-        # /{storeHash}.narinfo
-        elif m := re.match(r"^\/([a-z0-9]+)\.narinfo$", self.path):
-            store_hash = m.group(1)
-            response : bytes | None = None
-
-            path = StorePath.get(self.server.cache.name, store_hash=m.group(1))
-            if path:
-                response = path.get_narinfo().encode()
-                self.send_response(200)
-                self.send_header("Content-Type", "text/x-nix-narinfo")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(True, response_time)
-                return
-
-            path = StorePath.find(m.group(1))
-            if path:
-                response = path.get_narinfo().encode()
-                narinfo_dict = self.server.cache.sign(response)
-                response = self.server.remote.narinfo_dict_to_bytes(narinfo_dict)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/x-nix-narinfo")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-
-            remote_cache_url = self.server.remote.get_remote_cache_url(store_hash)
-            if not remote_cache_url or remote_cache_url == self.server.cache.url:
-                self.send_response(404)
-                self.end_headers()
-
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            response, status = self.server.remote.fetch_and_process_remote_narinfo(
-                store_hash,
-                remote_cache_url
-            )
-
-            if not response:
-                self.send_response(status)
-                self.end_headers()
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            self.send_response(status)
-            self.send_header("Content-Type", "text/x-nix-narinfo")
-            self.send_header("Content-Length", str(len(response)))
-            self.end_headers()
-            self.wfile.write(response)
-
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(False, response_time)
-
-        # /nar/{fileHash}.nar.{compression}
-        elif m := re.match(r"^/nar/([a-z0-9]+)\.nar\.(xz|zst)$", self.path):
-            file_hash = m.group(1)
-            compression = m.group(2)
-            nar_path = f"nar/{file_hash}.nar.{compression}"
-
-            # try to find the nar file in the local cache
-            path = StorePath.get(self.server.cache.name, file_hash=m.group(1))
-            if path:
-                nar_file = f"{file_hash}.nar.{compression}"
-                try:
-                    response = path.storage.read(nar_file, binary=True)
-                    self.send_response(200)
-                    self.send_header("Content-Type", "application/octet-stream")
-                    self.send_header("Content-Length", str(len(response)))
-                    self.end_headers()
-                    self.wfile.write(response)
-
-                    response_time = time.time() - start_time
-                    self.server.cache.metrics.record_request(True, response_time)
-                    return
-                except Exception as e:
-                    response_time = time.time() - start_time
-                    self.server.cache.metrics.record_request(False, response_time)
-                    print(f"Error reading local nar file: {e}")
-
-            # try to find the nar file in the other local cache
-            path = StorePath.find(file_hash=m.group(1))
-            if path:
-                nar_file = f"{file_hash}.nar.{compression}"
-                try:
-                    response = path.storage.read(nar_file, binary=True)
-
-                    self.send_response(200)
-                    self.send_header("Content-Type", "application/octet-stream")
-                    self.send_header("Content-Length", str(len(response)))
-                    self.end_headers()
-                    self.wfile.write(response)
-
-                    response_time = time.time() - start_time
-                    self.server.cache.metrics.record_request(False, response_time)
-                    return
-                except Exception as e:
-                    response_time = time.time() - start_time
-                    self.server.cache.metrics.record_request(False, response_time)
-                    print(f"Error reading local nar file: {e}")
-
-            if nar_path in self.server.remote.cached_paths:
-                remote_cache_url = self.server.remote.cached_paths[nar_path]
-                response, status = self.server.remote.fetch_remote_nar_file(
-                    file_hash,
-                    compression,
-                    remote_cache_url,
-                )
-
-                if not response:
-                    self.send_response(status)
-                    self.end_headers()
-                    response_time = time.time() - start_time
-                    self.server.cache.metrics.record_request(False, response_time)
-                    return
-
-                self.send_response(status)
-                self.send_header("Content-Type", "application/octet-stream")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            self.send_response(404)
-            self.end_headers()
+        hit = self.route_get(self.path)
+        self.record_request(start_time, hit)
 
     def do_PUT(self) -> None:
-        start_time = time.time()
-        # /{narUuid}
-        if m := re.match(
-            r"^/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})$",
-            self.path,
-        ):
-
-            content_length = int(self.headers["Content-Length"])
-
-            name = m.group(1)
-            findings = self.server.cache.storage.find(name)
-            if findings is None:
-                self.send_response(400)
-                self.end_headers()
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            filename, storage = findings
-
-            if not filename:
-                self.send_response(400)
-                self.end_headers()
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            body = self.rfile.read(content_length)
-
-
-            self.server.cache.dht.put(filename, self.server.cache.id)
-
-            storage.save(filename, body)
-
-            self.send_response(201)
-            self.send_header("Content-Location", "/")
-            self.end_headers()
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(True, response_time)
-        else:
-            self.send_response(400)
-            self.end_headers()
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(False, response_time)
+        start_time = time.perf_counter()
+        hit = self.dispatch(self.PUT_ROUTES)
+        self.record_request(start_time, hit)
 
     def do_HEAD(self) -> None:
-        start_time = time.time()
+        start_time = time.perf_counter()
+
+        if not self.authorize():
+            self.record_request(start_time, True)
+            return
+
+        hit = self.dispatch(self.HEAD_ROUTES)
+        self.record_request(start_time, hit)
+
+    def route_get(self, path: str) -> Optional[bool]:
+        """Dispatch a GET request by its path prefix, regexes only validate the hashes.
+
+        Returns:
+            Optional[bool]: value returned by the handler, None if no route matched
+        """
+        if path == "/nix-cache-info":
+            return self.nix_cache_info()
+
+        if path.startswith("/nar/"):
+            # /nar/{fileHash}.nar.{compression}
+            file_hash, separator, compression = path[5:].partition(".nar.")
+            if separator and compression in COMPRESSIONS and is_hash(file_hash):
+                return self.nar(file_hash, compression)
+
+        elif path.endswith(".narinfo"):
+            # /{storeHash}.narinfo
+            store_hash = path[1:-8]
+            if path[0] == "/" and is_hash(store_hash):
+                return self.narinfo(store_hash)
+
+        self.send_body(400)
+        return None
+
+    def record_request(self, start_time: float, hit: Optional[bool]) -> None:
+        """Record the request in the cache metrics, unmatched requests count as misses."""
+        self.server.cache.metrics.record_request(bool(hit), time.perf_counter() - start_time)
 
+    def authorize(self) -> bool:
+        """Check the credentials of a private cache, respond with 401 on failure."""
         if self.server.cache.is_private():
-            if (
-                base64.b64decode(self.headers["Authorization"].split()[1]).decode(
-                    "utf-8"
-                )[1:]
-                != self.server.cache.token
-            ):
-                self.send_response(401)
-                self.end_headers()
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(True, response_time)
-                return
-
-        # /{storeHash}.narinfo
-        if m := re.match(r"^\/([a-z0-9]+)\.narinfo", self.path):
-
-            path = StorePath.get(self.server.cache.name, store_hash=m.group(1))
-            if not path:
-                self.send_response(400)
-                self.end_headers()
-                response_time = time.time() - start_time
-                self.server.cache.metrics.record_request(False, response_time)
-                return
-
-            self.send_response(200)
-            self.end_headers()
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(True, response_time)
-        else:
-            self.send_response(400)
-            self.end_headers()
-            response_time = time.time() - start_time
-            self.server.cache.metrics.record_request(False, response_time)
+            authorization = (self.headers["Authorization"] or "").encode("utf-8")
+            if not hmac.compare_digest(authorization, self.server.authorization):
+                self.send_body(401)
+                return False
+        return True
+
+    # /nix-cache-info
+    def nix_cache_info(self) -> bool:
+        self.send_body(200, NIX_CACHE_INFO, BINARY_CONTENT_TYPE)
+        return True
+
+    # /{storeHash}.narinfo
+    def narinfo(self, store_hash: str) -> bool:
+        cache, remote, narinfos = self.server.cache, self.server.remote, self.server.narinfos
+        missing = self.server.missing_narinfos
+        response : bytes | None = None
+
+        cached = narinfos.get(store_hash)
+        if cached:
+            response, hit = cached
+            self.send_body(200, response, NARINFO_CONTENT_TYPE)
+            return hit
+
+        path = StorePath.get(cache.name, store_hash=store_hash)
+        if path:
+            response = path.get_narinfo().encode()
+            narinfos.put(store_hash, (response, True))
+            self.send_body(200, response, NARINFO_CONTENT_TYPE)
+            return True
+
+        path = StorePath.find(store_hash)
+        if path:
+            response = path.get_narinfo().encode()
+            narinfo_dict = cache.sign(response)
+            response = remote.narinfo_dict_to_bytes(narinfo_dict)
+            # not memoized, the other cache's process may garbage-collect the path at any time
+            self.send_body(200, response, NARINFO_CONTENT_TYPE)
+            return False
+
+        # only remote lookups are skipped, pushes to this server are found above right away
+        if missing.get(store_hash):
+            self.send_body(404)
+            return False
+
+        response = remote.get_cached_narinfo(store_hash)
+        if response:
+            self.send_body(200, response, NARINFO_CONTENT_TYPE)
+            return False
+
+        remote_cache_url = remote.get_remote_cache_url(store_hash)
+        if not remote_cache_url or remote_cache_url == cache.url:
+            missing.put(store_hash, True)
+            self.send_body(404)
+            return False
+
+        response, status = remote.fetch_and_process_remote_narinfo(
+            store_hash,
+            remote_cache_url
+        )
+
+        if not response:
+            self.send_body(status)
+            return False
+
+        self.send_body(status, response, NARINFO_CONTENT_TYPE)
+        return False
+
+    # /nar/{fileHash}.nar.{compression}
+    def nar(self, file_hash: str, compression: str) -> bool:
+        cache, remote = self.server.cache, self.server.remote
+        nar_path = f"nar/{file_hash}.nar.{compression}"
+        nar_file = f"{file_hash}.nar.{compression}"
+
+        # try to find the nar file in the local cache
+        path = StorePath.get(cache.name, file_hash=file_hash)
+        if path and self.send_nar_file(path, nar_file):
+            return True
+
+        # try to find the nar file in the other local cache
+        path = StorePath.find(file_hash=file_hash)
+        if path and self.send_nar_file(path, nar_file):
+            return False
+
+        if nar_path in remote.cached_paths:
+            remote_cache_url = remote.cached_paths[nar_path]
+            with remote.open_remote_nar_file(file_hash, compression, remote_cache_url) as (stream, status):
+                if stream is None:
+                    self.send_body(status)
+                elif stream.length is None:
+                    # chunked response, the length isn't known up front
+                    self.send_body(status, stream.read(), BINARY_CONTENT_TYPE)
+                else:
+                    self.send_stream(status, stream, stream.length, BINARY_CONTENT_TYPE)
+            return False
+
+        self.send_body(404)
+        return False
+
+    def send_nar_file(self, path: StorePath, nar_file: str) -> bool:
+        """Stream a nar file from the storage of the store path.
+
+        Returns:
+            bool: True if the file was sent, False if it couldn't be opened
+        """
+        try:
+            stream, size = path.storage.open(nar_file)
+        except Exception as e:
+            print(f"Error reading local nar file: {e}")
+            return False
+
+        try:
+            self.send_stream(200, stream, size, BINARY_CONTENT_TYPE)
+        finally:
+            stream.close()
+        return True
+
+    # /{narUuid}
+    def nar_upload(self, m: re.Match[str]) -> bool:
+        name = m.group(1)
+        cache = self.server.cache
+        findings = cache.storage.find(name)
+        if findings is None:
+            self.send_body(400)
+            return False
+
+        filename, storage = findings
+
+        if not filename:
+            self.send_body(400)
+            return False
+
+        cache.dht.submit(filename, cache.id)
+
+        stream, length = self.body_stream()
+        storage.save_stream(filename, stream, length)
+
+        self.send_body(201, headers={"Content-Location": "/"})
+        return True
+
+    # /{storeHash}.narinfo
+    def narinfo_head(self, m: re.Match[str]) -> bool:
+        path = StorePath.get(self.server.cache.name, store_hash=m.group(1))
+        if not path:
+            self.send_body(400)
+            return False
+
+        self.send_body(200)
+        return True
+
+    PUT_ROUTES: Routes = (
+        (NAR_UPLOAD_RE, nar_upload),
+    )
+
+    HEAD_ROUTES: Routes = (
+        (NARINFO_HEAD_RE, narinfo_head),
+    )
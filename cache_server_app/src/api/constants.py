@@ -9,5 +9,25 @@ Date: 28.4.2025
 """
 
 
+# content types
+JSON_CONTENT_TYPE = "application/json"
+NARINFO_CONTENT_TYPE = "text/x-nix-narinfo"
+BINARY_CONTENT_TYPE = "application/octet-stream"
+
 # server
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DEPLOYMENT_START_TIMEOUT = 10 # seconds
+WRITE_BUFFER_SIZE = 64 * 1024 # bytes
+REQUEST_QUEUE_SIZE = 1024 # pending connections
+IDLE_TIMEOUT = 60 # seconds a keep-alive connection may stay silent
+
+# deployment log
+ACTIVATION_SUCCEEDED = "Successfully activated the deployment."
+ACTIVATION_FAILED = "Failed to activate the deployment."
+
+# binary cache
+COMPRESSIONS = frozenset(("xz", "zst"))
+NARINFO_CACHE_SIZE = 50_000
+NARINFO_CACHE_TTL = 300 # seconds
+NARINFO_MISS_CACHE_SIZE = 100_000
+NARINFO_MISS_CACHE_TTL = 60 # seconds
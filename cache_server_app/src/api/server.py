@@ -10,17 +10,27 @@ Date: 17.4.2025
 """
 
 import asyncio
-import json
 import os
 import re
+import threading
 import uuid
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
-from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from cache_server_app.src.api.constants import DATETIME_FORMAT
+import orjson
+
+from cache_server_app.src.api.base import HTTPServer, RequestHandler, credentials, valid_token
+from cache_server_app.src.api.constants import (
+    ACTIVATION_FAILED,
+    ACTIVATION_SUCCEEDED,
+    COMPRESSIONS,
+    DATETIME_FORMAT,
+    DEPLOYMENT_START_TIMEOUT,
+    JSON_CONTENT_TYPE,
+)
 import websockets
 from websockets.server import WebSocketServerProtocol
-from typing import Any, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeAlias
 
 from cache_server_app.src.agent import Agent
 from cache_server_app.src.cache.base import BinaryCache
@@ -28,15 +38,35 @@ from cache_server_app.src.store_path import StorePath
 from cache_server_app.src.dht.node import DHT
 import cache_server_app.src.config.base as config
 
+UUID_RE = re.compile(r"[a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12}")
+NAME_RE = re.compile(r"[a-z0-9]+")
 
-class HTTPCacheServer(ThreadingHTTPServer):
+# handler(self, segments after the prefix, query string) -> False if the path isn't routed
+PrefixRoutes: TypeAlias = Dict[Tuple[str, ...], Callable[[Any, List[str], str], bool]]
+
+
+@dataclass(slots=True)
+class DeploymentRecord:
+    """State of a deployment started through the API.
+
+    Attributes:
+        status: deployment status (InProgress, Succeeded, Failed)
+        created_on: formatted time the deployment was created
+        started_on: formatted time the deployment was started
+    """
+    status: str
+    created_on: str
+    started_on: str
+
+
+class HTTPCacheServer(HTTPServer):
     def __init__(self, server_address: Tuple[str, int], request_handler: type["CacheServerRequestHandler"], websocket_handler: "WebSocketConnectionHandler") -> None:
         self.websocket_handler = websocket_handler
         self.dht = DHT.get_instance()
         super().__init__(server_address, request_handler)
 
 
-class CacheServerRequestHandler(BaseHTTPRequestHandler):
+class CacheServerRequestHandler(RequestHandler):
     """
     Class to handle cache-server HTTP requests.
     """
@@ -46,268 +76,306 @@ class CacheServerRequestHandler(BaseHTTPRequestHandler):
         self.server: HTTPCacheServer # type: ignore
 
     def do_GET(self) -> None:
-        # /api/v1/dht/get/{key}
-        if m := re.match(r"^/api/v1/dht/get/([^/]+)$", self.path):
-            key = m.group(1)
-
-            result = self.server.dht.get(key)
-            response = json.dumps({"value": result}).encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Content-Length", str(len(response)))
-            self.end_headers()
-            try:
-                self.wfile.write(response)
-            except BrokenPipeError:
-                print("Client disconnected before response was sent")
+        self.route(self.GET_ROUTES)
+
+    def do_POST(self) -> None:
+        self.route(self.POST_ROUTES)
+
+    def route(self, routes: PrefixRoutes) -> None:
+        """Dispatch a request by its first three path segments, then by the rest.
+
+        Regexes only validate the cache names and ids. Responds with 400 if
+        no route matches.
+        """
+        path, _, query = self.path.partition("?")
+        segments = path.split("/")
+
+        handler = routes.get(tuple(segments[1:4]))
+        if not handler or not handler(self, segments[4:], query):
+            self.send_body(400)
+
+    # /api/v1/dht/...
+    def route_dht_get(self, segments: List[str], query: str) -> bool:
+        if len(segments) == 2 and segments[0] == "get" and segments[1]:
+            self.dht_get(segments[1])
+            return True
+        return False
+
+    def route_dht_post(self, segments: List[str], query: str) -> bool:
+        if segments == ["put"]:
+            self.dht_put()
+            return True
+        return False
+
+    # /api/v1/cache/...
+    def route_cache_get(self, segments: List[str], query: str) -> bool:
+        if len(segments) == 1 and NAME_RE.fullmatch(segments[0]):
+            self.cache_info(segments[0])
+            return True
+        return False
+
+    def route_cache_post(self, segments: List[str], query: str) -> bool:
+        if not segments or not NAME_RE.fullmatch(segments[0]):
+            return False
+
+        name, rest = segments[0], segments[1:]
+        if rest == ["narinfo"]:
+            self.narinfo(name)
+        elif rest == ["multipart-nar"]:
+            compression = query.removeprefix("compression=")
+            if compression == query or compression not in COMPRESSIONS:
+                return False
+            self.multipart_nar(name, compression)
+        elif len(rest) >= 2 and rest[0] == "multipart-nar" and UUID_RE.fullmatch(rest[1]):
+            if len(rest) == 2:
+                self.multipart_nar_upload(name, rest[1])
+            elif rest[2:] == ["complete"]:
+                self.multipart_nar_complete(name, rest[1])
+            elif rest[2:] == ["abort"]:
+                self.multipart_nar_abort(name, rest[1])
+            else:
+                return False
+        else:
+            return False
+        return True
+
+    # /api/v1/deploy/...
+    def route_deploy_get(self, segments: List[str], query: str) -> bool:
+        if len(segments) == 2 and segments[0] == "deployment" and UUID_RE.fullmatch(segments[1]):
+            self.deployment(segments[1])
+            return True
+        return False
+
+    # /api/v2/deploy/...
+    def route_deploy_post(self, segments: List[str], query: str) -> bool:
+        if segments == ["activate"]:
+            self.deploy_activate()
+            return True
+        return False
+
+    def get_cache(self, name: str, authorize: bool = True) -> Optional[BinaryCache]:
+        """Get the cache for the request, respond with an error if it can't be used.
+
+        Args:
+            name: name of the cache
+            authorize: if False, the token is checked only for private caches
+
+        Returns:
+            Optional[BinaryCache]: cache object, None if response was already sent
+        """
+        cache = BinaryCache.get(name=name)
+        if not cache:
+            self.send_body(400)
+            return None
+
+        if authorize or cache.is_private():
+            if not valid_token(credentials(self.headers["Authorization"]), cache.token):
+                self.send_body(401)
+                return None
+
+        return cache
+
+    # /api/v1/dht/get/{key}
+    def dht_get(self, key: str) -> None:
+        result = self.server.dht.get(key)
+        response = orjson.dumps({"value": result})
+        try:
+            self.send_body(200, response, JSON_CONTENT_TYPE)
+        except BrokenPipeError:
+            print("Client disconnected before response was sent")
+
+    # /api/v1/cache/{name}
+    def cache_info(self, name: str) -> None:
+        cache = self.get_cache(name, authorize=False)
+        if not cache:
             return
 
-        elif m := re.match(r"^/api/v1/cache/([a-z0-9]*)(\?)?", self.path):
-            cache = BinaryCache.get(name=m.group(1))
-            if not cache:
-                self.send_response(400)
-                self.end_headers()
-                return
+        response = cache.cache_json("Read")
+        self.send_body(200, response, JSON_CONTENT_TYPE)
 
-            if cache.is_private():
-                if self.headers["Authorization"].split()[1] != cache.token:
-                    self.send_response(401)
-                    self.end_headers()
-
-            # /api/v1/cache/{name}
-            if m := re.match(r"^/api/v1/cache/([a-z0-9]*)(\?)?$", self.path):
-                response = cache.cache_json("Read").encode("utf-8")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-        # /api/v1/deploy/deployment/{uuid}
-        elif m := re.match(
-            r"^/api/v1/deploy/deployment/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})(\?)?",
-            self.path,
-        ):
-            deploy_id = m.group(1)
-            deploy_status = self.server.websocket_handler.deployments[deploy_id]
-            response = json.dumps(
-                {
-                    "closureSize": 0,
-                    "createdOn": datetime.now(timezone.utc).strftime(
-                        DATETIME_FORMAT
-                    ),
-                    "id": deploy_id,
-                    "index": 0,
-                    "startedOn": datetime.now(timezone.utc).strftime(
-                        DATETIME_FORMAT
-                    ),
-                    "status": deploy_status,
-                    "storePath": "",
-                }
-            ).encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Content-Length", str(len(response)))
-            self.end_headers()
-            self.wfile.write(response)
+    # /api/v1/deploy/deployment/{uuid}
+    def deployment(self, deploy_id: str) -> None:
+        deployment = self.server.websocket_handler.get_deployment(deploy_id)
+        if not deployment:
+            self.send_body(404)
+            return
+
+        response = orjson.dumps(
+            {
+                "closureSize": 0,
+                "createdOn": deployment.created_on,
+                "id": deploy_id,
+                "index": 0,
+                "startedOn": deployment.started_on,
+                "status": deployment.status,
+                "storePath": "",
+            }
+        )
+        self.send_body(200, response, JSON_CONTENT_TYPE)
 
+    # /api/v1/dht/put
+    def dht_put(self) -> None:
+        body = orjson.loads(self.read_body())
+
+        # to make sure that dht put is non-blocking
+        def done(ok: bool, _: Any) -> None:
+            pass
+            # if not ok:
+            #     print("ERROR: DHT put failed")
+
+        if "key" in body and "value" in body:
+            self.server.dht.put(body["key"], body["value"], done, permanent=body["permanent"])
+            self.send_body(200)
         else:
-            self.send_response(400)
-            self.end_headers()
+            self.send_body(500)
 
-    def do_POST(self) -> None:
-        # /api/v1/dht/put
-        if self.path == "/api/v1/dht/put":
-            content_length = int(self.headers["Content-Length"])
-            body = json.loads(self.rfile.read(content_length).decode("utf-8"))
+    # /api/v1/cache/{name}/narinfo
+    def narinfo(self, cache_name: str) -> None:
+        cache = self.get_cache(cache_name)
+        if not cache:
+            return
 
-            # to make sure that dht put is non-blocking
-            def done(ok: bool, _: Any) -> None:
-                pass
-                # if not ok:
-                #     print("ERROR: DHT put failed")
+        body = orjson.loads(self.read_body())
+        response = orjson.dumps(cache.get_missing_store_hashes(body))
+        self.send_body(200, response, JSON_CONTENT_TYPE)
 
-            if "key" in body and "value" in body:
-                self.server.dht.put(body["key"], body["value"], done, permanent=body["permanent"])
-                self.send_response(200)
-                self.end_headers()
-            else:
-                self.send_response(500)
-                self.end_headers()
+    # /api/v1/cache/{name}/multipart-nar
+    def multipart_nar(self, cache_name: str, compression: str) -> None:
+        cache = self.get_cache(cache_name)
+        if not cache:
             return
 
-        elif m := re.match(r"^/api/v1/cache/([a-z0-9]*)", self.path):
+        nar_id = str(uuid.uuid4())
+        response = orjson.dumps({"narId": nar_id, "uploadId": nar_id})
 
-            cache = BinaryCache.get(name=m.group(1))
+        filename = f"{nar_id}.nar.{compression}"
+        cache.storage.new_file(filename, upload=True)
 
-            if not cache:
-                self.send_response(400)
-                self.end_headers()
-                return
+        self.server.dht.put(filename, cache.id)
 
-            if self.headers["Authorization"].split()[1] != cache.token:
-                self.send_response(401)
-                self.end_headers()
-                return
+        self.send_body(200, response, JSON_CONTENT_TYPE)
 
-            # /api/v1/cache/{name}/narinfo
-            if re.match(r"^/api/v1/cache/[a-z0-9]*/narinfo(\?)?$", self.path):
-                content_length = int(self.headers["Content-Length"])
-                body = json.loads(self.rfile.read(content_length).decode("utf-8"))
-                response = json.dumps(cache.get_missing_store_hashes(body)).encode(
-                    "utf-8"
-                )
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-            # /api/v1/cache/{name}/multipart-nar
-            elif m := re.match(
-                r"^/api/v1/cache/[a-z0-9]*/multipart-nar\?compression=(xz|zst)$",
-                self.path,
-            ):
-                id = uuid.uuid4()
-                response = """{{
-                    "narId": "{}",
-                    "uploadId": "{}"
-                    }}""".format(
-                    id, id
-                ).encode(
-                    "utf-8"
-                )
-
-                filename = f"{id}.nar.{m.group(1)}"
-                cache.storage.new_file(filename)
-
-                self.server.dht.put(filename, cache.id)
-
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-            # /api/v1/cache/{name}/multipart-nar/{narUuid}/complete
-            elif m := re.match(
-                r"^/api/v1/cache/[a-z0-9]+/multipart-nar/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})/complete(\?)?",
-                self.path,
-            ):
-                content_length = int(self.headers["Content-Length"])
-                body = json.loads(self.rfile.read(content_length).decode("utf-8"))
-                narinfo_create = body["narInfoCreate"]
-
-                name = m.group(1)
-                finding = cache.storage.find(name)
-                if finding is None:
-                    self.send_response(400)
-                    self.end_headers()
-                    return
-
-                filename, storage = finding
-
-                StorePath(
-                    id=str(uuid.uuid4()),
-                    store_hash=narinfo_create["cStoreHash"],
-                    store_suffix=narinfo_create["cStoreSuffix"],
-                    file_hash=narinfo_create["cFileHash"],
-                    file_size=narinfo_create["cFileSize"],
-                    nar_hash=narinfo_create["cNarHash"],
-                    nar_size=narinfo_create["cNarSize"],
-                    deriver=narinfo_create["cDeriver"],
-                    references=narinfo_create["cReferences"],
-                    storage=storage
-                ).save()
-
-                new_filename = "{}.nar{}".format(
-                    narinfo_create["cFileHash"], os.path.splitext(filename)[1]
-                )
-
-                if cache.is_public():
-                    self.server.dht.put(narinfo_create["cStoreHash"], cache.id)
-
-                storage.rename(filename, new_filename)
-
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-
-            # /api/v1/cache/{name}/multipart-nar/{narUuid}/abort
-            elif m := re.match(
-                r"^/api/v1/cache/[a-z0-9]+/multipart-nar/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})/abort(\?)?",
-                self.path,
-            ):
-                name = m.group(1)
-                findings = cache.storage.find(name)
-
-                if findings is None:
-                    self.send_response(400)
-                    self.end_headers()
-                    return
-
-                filename, storage = findings
-
-                storage.remove(filename)
-
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-
-            # /api/v1/cache/{name}/multipart-nar/{narUuid}
-            elif m := re.match(
-                r"^/api/v1/cache/[a-z0-9]+/multipart-nar/([a-z0-9]{8}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{4}-[a-z0-9]{12})(\?)?",
-                self.path,
-            ):
-
-                content_length = int(self.headers["Content-Length"])
-                body = json.loads(self.rfile.read(content_length).decode("utf-8"))
-                upload_url = os.path.join(cache.url, m.group(1))
-                response = """{{
-                    "uploadUrl": "{}"
-                }}""".format(
-                    upload_url
-                ).encode(
-                    "utf-8"
-                )
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.send_header("Content-Length", str(len(response)))
-                self.end_headers()
-                self.wfile.write(response)
-
-        # /api/v2/deploy/activate
-        elif m := re.match(r"^/api/v2/deploy/activate(\?)?", self.path):
-            content_length = int(self.headers["Content-Length"])
-            body = json.loads(self.rfile.read(content_length).decode("utf-8"))
-            agents = {}
-
-            for agent, path in body["agents"].items():
-                if not Agent.get(name=agent):
-                    self.send_response(400)
-                    self.end_headers()
-                    return
-
-                deploy_id = str(uuid.uuid4())
-                agent_item = {"id": deploy_id, "url": ""}
-                agents[f"{agent}"] = agent_item
-                asyncio.run(
-                    self.server.websocket_handler.start_deployment(
-                        agent, path, deploy_id
-                    )
-                )
-
-            response = json.dumps({"agents": agents}).encode("utf-8")
-
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Content-Length", str(len(response)))
-            self.end_headers()
-            self.wfile.write(response)
+    # /api/v1/cache/{name}/multipart-nar/{narUuid}/complete
+    def multipart_nar_complete(self, cache_name: str, name: str) -> None:
+        cache = self.get_cache(cache_name)
+        if not cache:
+            return
 
-        else:
-            self.send_response(400)
-            self.end_headers()
+        body = orjson.loads(self.read_body())
+        narinfo_create = body["narInfoCreate"]
+
+        finding = cache.storage.find(name)
+        if finding is None:
+            self.send_body(400)
+            return
+
+        filename, storage = finding
+
+        StorePath(
+            id=str(uuid.uuid4()),
+            store_hash=narinfo_create["cStoreHash"],
+            store_suffix=narinfo_create["cStoreSuffix"],
+            file_hash=narinfo_create["cFileHash"],
+            file_size=narinfo_create["cFileSize"],
+            nar_hash=narinfo_create["cNarHash"],
+            nar_size=narinfo_create["cNarSize"],
+            deriver=narinfo_create["cDeriver"],
+            references=narinfo_create["cReferences"],
+            storage=storage
+        ).save()
+
+        new_filename = "{}.nar{}".format(
+            narinfo_create["cFileHash"], os.path.splitext(filename)[1]
+        )
+
+        if cache.is_public():
+            self.server.dht.put(narinfo_create["cStoreHash"], cache.id)
+
+        storage.rename(filename, new_filename)
+        cache.storage.release(name)
+
+        self.send_body(200, content_type=JSON_CONTENT_TYPE)
+
+    # /api/v1/cache/{name}/multipart-nar/{narUuid}/abort
+    def multipart_nar_abort(self, cache_name: str, name: str) -> None:
+        cache = self.get_cache(cache_name)
+        if not cache:
+            return
+
+        findings = cache.storage.find(name)
+
+        if findings is None:
+            self.send_body(400)
+            return
+
+        filename, storage = findings
+
+        storage.remove(filename)
+        cache.storage.release(name)
+
+        self.send_body(200, content_type=JSON_CONTENT_TYPE)
+
+    # /api/v1/cache/{name}/multipart-nar/{narUuid}
+    def multipart_nar_upload(self, cache_name: str, nar_id: str) -> None:
+        cache = self.get_cache(cache_name)
+        if not cache:
+            return
+
+        body = orjson.loads(self.read_body())
+        upload_url = os.path.join(cache.url, nar_id)
+        response = orjson.dumps({"uploadUrl": upload_url})
+        self.send_body(200, response, JSON_CONTENT_TYPE)
+
+    # /api/v2/deploy/activate
+    def deploy_activate(self) -> None:
+        body = orjson.loads(self.read_body())
+        agents = {}
+
+        websocket_handler = self.server.websocket_handler
+        if not websocket_handler.loop:
+            print("ERROR: WebSocket server is not running")
+            self.send_body(503)
+            return
+
+        # validate all agents with one query before starting any deployment
+        names = set(body["agents"])
+        if len(Agent.get_rows(list(names))) != len(names):
+            self.send_body(400)
+            return
+
+        deployments = []
+        for agent, path in body["agents"].items():
+            deploy_id = str(uuid.uuid4())
+            agent_item = {"id": deploy_id, "url": ""}
+            agents[f"{agent}"] = agent_item
+            deployments.append((agent, path, deploy_id))
+
+        future = asyncio.run_coroutine_threadsafe(
+            websocket_handler.start_deployments(deployments),
+            websocket_handler.loop,
+        )
+        try:
+            future.result(timeout=DEPLOYMENT_START_TIMEOUT)
+        except Exception as e:
+            print(f"ERROR: Failed to start deployment: {e}")
+            self.send_body(500)
+            return
+
+        response = orjson.dumps({"agents": agents})
+
+        self.send_body(200, response, JSON_CONTENT_TYPE)
+
+    GET_ROUTES: PrefixRoutes = {
+        ("api", "v1", "dht"): route_dht_get,
+        ("api", "v1", "cache"): route_cache_get,
+        ("api", "v1", "deploy"): route_deploy_get,
+    }
+
+    POST_ROUTES: PrefixRoutes = {
+        ("api", "v1", "dht"): route_dht_post,
+        ("api", "v1", "cache"): route_cache_post,
+        ("api", "v2", "deploy"): route_deploy_post,
+    }
 
 
 class WebSocketConnectionHandler:
@@ -318,15 +386,31 @@ class WebSocketConnectionHandler:
         port: port on which the WebSocket server runs
         agents: dictionary containing agent connections
         deployments: dictionary containing deployment connections
+        loop: event loop running the WebSocket server, None until it starts
     """
 
     def __init__(self, port: int):
         self.port = port
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
         self.agents: dict[str, WebSocketServerProtocol] = {}
-        self.deployments: dict[str, str] = {}
+        self.deployments: dict[str, DeploymentRecord] = {}
+        # deployments are written by the event loop and read by HTTP threads
+        self._deployments_lock = threading.Lock()
         self._stop_event = asyncio.Event()
 
 
+    def get_deployment(self, deploy_id: str) -> Optional[DeploymentRecord]:
+        """Get a snapshot of the deployment, None if it doesn't exist."""
+        with self._deployments_lock:
+            deployment = self.deployments.get(deploy_id)
+            return replace(deployment) if deployment else None
+
+    def set_deployment_status(self, deploy_id: str, status: str) -> None:
+        with self._deployments_lock:
+            deployment = self.deployments.get(deploy_id)
+            if deployment:
+                deployment.status = status
+
     async def agent_handler(self, websocket: WebSocketServerProtocol) -> None:
         agent = Agent.get(name=websocket.request_headers["name"])
         if not agent:
@@ -334,13 +418,14 @@ class WebSocketConnectionHandler:
             return
 
         try:
-            if websocket.request_headers["Authorization"].split()[1] != agent.token:
+            if not valid_token(credentials(websocket.request_headers.get("Authorization")), agent.token):
                 await websocket.close()
                 return
 
             cache = agent.workspace.cache
             self.agents[agent.name] = websocket
-            message = json.dumps(
+            # sent as a text frame, agents don't accept binary messages
+            message = orjson.dumps(
                 {
                     "agent": agent.id,
                     "command": {
@@ -353,7 +438,7 @@ class WebSocketConnectionHandler:
                     "id": "00000000-0000-0000-0000-000000000000",
                     "method": "AgentRegistered",
                 }
-            )
+            ).decode("utf-8")
 
             await websocket.send(message)
 
@@ -368,12 +453,16 @@ class WebSocketConnectionHandler:
     async def deployment_handler(self, websocket: WebSocketServerProtocol) -> None:
         try:
             async for message in websocket:
-                message_dict = json.loads(message)
+                if isinstance(message, bytes):
+                    message = message.decode("utf-8")
+                # skip parsing messages that can't be a finished deployment
+                if "DeploymentFinished" not in message:
+                    continue
+
+                message_dict = orjson.loads(message)
                 if message_dict["method"] == "DeploymentFinished":
-                    if message_dict["command"]["hasSucceeded"]:
-                        self.deployments[message_dict["command"]["id"]] = "Succeeded"
-                    else:
-                        self.deployments[message_dict["command"]["id"]] = "Failed"
+                    status = "Succeeded" if message_dict["command"]["hasSucceeded"] else "Failed"
+                    self.set_deployment_status(message_dict["command"]["id"], status)
                     await websocket.close()
 
         except websockets.exceptions.ConnectionClosed:
@@ -384,10 +473,16 @@ class WebSocketConnectionHandler:
             await websocket.close()
         try:
             async for message in websocket:
-                message_dict = json.loads(message)
-                if message_dict["line"] == "Successfully activated the deployment.":
+                if isinstance(message, bytes):
+                    message = message.decode("utf-8")
+                # most lines are plain log output, parse only the ones ending activation
+                if ACTIVATION_SUCCEEDED not in message and ACTIVATION_FAILED not in message:
+                    continue
+
+                line = orjson.loads(message)["line"]
+                if line == ACTIVATION_SUCCEEDED:
                     await websocket.close()
-                if "Failed to activate the deployment." in message_dict["line"]:
+                if ACTIVATION_FAILED in line:
                     await websocket.close()
 
         except websockets.exceptions.ConnectionClosed:
@@ -410,8 +505,10 @@ class WebSocketConnectionHandler:
         if not agent:
             return None
         websocket = self.agents[agent.name]
-        self.deployments[deploy_id] = "InProgress"
-        message = json.dumps(
+        now = datetime.now(timezone.utc).strftime(DATETIME_FORMAT)
+        with self._deployments_lock:
+            self.deployments[deploy_id] = DeploymentRecord("InProgress", now, now)
+        message = orjson.dumps(
             {
                 "agent": agent.id,
                 "command": {
@@ -426,11 +523,23 @@ class WebSocketConnectionHandler:
                 "id": "00000000-0000-0000-0000-000000000000",
                 "method": "Deployment",
             }
-        )
+        ).decode("utf-8")
         await websocket.send(message)
 
+    async def start_deployments(self, deployments: List[Tuple[str, str, str]]) -> None:
+        """Start deployments concurrently.
+
+        Args:
+            deployments: list of (agent name, store path, deployment id)
+        """
+        await asyncio.gather(
+            *(self.start_deployment(agent_name, path, deploy_id) for agent_name, path, deploy_id in deployments)
+        )
+
     async def run(self) -> None:
-        async with websockets.serve(self.handler, config.server_hostname, self.port):
+        self.loop = asyncio.get_running_loop()
+        # messages are small JSON, per-message deflate costs more CPU than it saves
+        async with websockets.serve(self.handler, config.server_hostname, self.port, compression=None):
             print(f"WebSocket server started on ws://{config.server_hostname}:{self.port}")
             await self._stop_event.wait()
 
@@ -10,23 +10,31 @@ Date: 1.5.2024
 """
 
 import base64
-import json
+import itertools
+import re
 import time
-from typing import Dict, List, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime, timedelta, timezone
-from cache_server_app.src.cache.constants import ADVERTISING_INTERVAL, GARBAGE_COLLECTION_INTERVAL
-from cache_server_app.src.types import BinaryCacheRow, NarInfoDict, StorePathRow
+from cache_server_app.src.cache.constants import ADVERTISING_INTERVAL, GARBAGE_COLLECTION_BATCH_SIZE, GARBAGE_COLLECTION_INTERVAL, LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL
+from cache_server_app.src.types import BinaryCacheRow, NarInfoDict, StorageRow, StorePathRow
 from cache_server_app.src.cache.metrics import CacheMetrics
-from collections import deque
 
 import ed25519
+import orjson
 
 import cache_server_app.src.config.base as config
 from cache_server_app.src.database import CacheServerDatabase
+from cache_server_app.src.storage.base import Storage
 from cache_server_app.src.storage.manager import StorageManager
+from cache_server_app.src.storage.constants import CONSIDERED_NEW_FILE_AGE
 from cache_server_app.src.storage.factory import StorageFactory
 from cache_server_app.src.cache.access import CacheAccess
 from cache_server_app.src.dht.client import DHTClient
+from cache_server_app.src.lru import LRUCache
+
+# "Key: value" narinfo line, the key ends at the first ": "
+NARINFO_FIELD_RE = re.compile(r"^([^\r\n]+?): ([^\r\n]*)", re.MULTILINE)
 
 class BinaryCache:
     """
@@ -44,6 +52,10 @@ class BinaryCache:
         storages: list of storage objects
     """
 
+    # caches looked up by name or id, shared by all request handler threads
+    _by_name: LRUCache["BinaryCache"] = LRUCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL)
+    _by_id: LRUCache["BinaryCache"] = LRUCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL)
+
     def __init__(
         self,
         id: str,
@@ -66,6 +78,13 @@ class BinaryCache:
         self.storage = storage
         self.dht = DHTClient.get_instance()
         self.metrics = CacheMetrics(self.id)
+        # rendered cache_json responses by permission
+        self._cache_json: Dict[str, bytes] = {}
+        self._public_key: Optional[str] = None
+        self._signing_key: Optional[Tuple[bytes, ed25519.SigningKey]] = None
+        # called with the store hashes of paths removed by garbage collection,
+        # lets servers of this cache drop what they memoized about them
+        self.removed_listeners: List[Callable[[List[str]], None]] = []
 
     @staticmethod
     def exist(id: Optional[str] = None, name: Optional[str] = None, port: Optional[int] = None) -> bool:
@@ -77,18 +96,57 @@ class BinaryCache:
 
     @staticmethod
     def get(id: Optional[str] = None, name: Optional[str] = None, port: Optional[int] = None) -> Optional['BinaryCache']:
+        if name and not id and not port:
+            return BinaryCache._get_cached(BinaryCache._by_name, name, name=name)
+
+        if id and not name and not port:
+            return BinaryCache._get_cached(BinaryCache._by_id, id, id=id)
+
+        return BinaryCache._get(id, name, port)
+
+    @staticmethod
+    def _get_cached(
+        lookups: LRUCache["BinaryCache"], key: str, id: Optional[str] = None, name: Optional[str] = None
+    ) -> Optional['BinaryCache']:
+        cache = lookups.get(key)
+        if cache is None:
+            cache = BinaryCache._get(id=id, name=name)
+            if cache:
+                lookups.put(key, cache)
+        return cache
+
+    @staticmethod
+    def get_all() -> List['BinaryCache']:
+        """Get all binary caches, loaded with two queries in total."""
+        database = CacheServerDatabase()
+        storages = database.get_caches_storages()
+        return [
+            BinaryCache._from_row(row, storages.get(row[0], []), database)
+            for row in database.get_binary_caches()
+        ]
+
+    @staticmethod
+    def _get(id: Optional[str] = None, name: Optional[str] = None, port: Optional[int] = None) -> Optional['BinaryCache']:
         database = CacheServerDatabase()
         row = database.get_binary_cache_row(id, name, port)
         if not row:
             return None
 
+        storages = database.get_caches_storages([row[0]])
+        return BinaryCache._from_row(row, storages.get(row[0], []), database)
+
+    @staticmethod
+    def _from_row(
+        row: BinaryCacheRow,
+        storage_rows: List[Tuple[StorageRow, Dict[str, str]]],
+        database: CacheServerDatabase,
+    ) -> 'BinaryCache':
         storages = []
-        for storage in database.get_cache_storages(row[0]):
+        for storage, storage_config in storage_rows:
             storage_id = storage[0]
             storage_name = storage[1]
             storage_type = storage[2]
             storage_root = storage[3]
-            storage_config = database.get_storage_config(storage_id)
             storages.append(StorageFactory.create_storage(storage_id, storage_name, storage_type, storage_root, storage_config))
 
         return BinaryCache(
@@ -99,7 +157,7 @@ class BinaryCache:
             row[4],
             row[5],
             row[6],
-            StorageManager(row[0], storages, row[7], json.loads(str(row[8])), database)
+            StorageManager(row[0], storages, row[7], orjson.loads(row[8]), database)
         )
 
     def is_public(self) -> bool:
@@ -109,6 +167,8 @@ class BinaryCache:
         return self.access == CacheAccess.PRIVATE
 
     def save(self) -> None:
+        BinaryCache._by_name.clear()
+        BinaryCache._by_id.clear()
         self.database.insert_binary_cache(
             self.id,
             self.name,
@@ -118,10 +178,13 @@ class BinaryCache:
             self.port,
             self.retention,
             self.storage.strategy,
-            json.dumps(self.storage.strategy_state),
+            orjson.dumps(self.storage.strategy_state).decode("utf-8"),
         )
 
     def update(self) -> None:
+        BinaryCache._by_name.clear()
+        BinaryCache._by_id.clear()
+        self._cache_json.clear()
         self.database.update_binary_cache(
             self.id,
             self.name,
@@ -131,46 +194,55 @@ class BinaryCache:
             self.port,
             self.retention,
             self.storage.strategy,
-            json.dumps(self.storage.strategy_state),
+            orjson.dumps(self.storage.strategy_state).decode("utf-8"),
         )
 
     def delete(self) -> None:
+        BinaryCache._by_name.clear()
+        BinaryCache._by_id.clear()
         self.storage.delete()
         self.database.delete_binary_cache(self.id)
 
-    def cache_json(self, permission: str) -> str:
-        public_key = self.storage.read("key.pub")
+    def cache_json(self, permission: str) -> bytes:
+        # the fields only change on update(), render them once per permission
+        response = self._cache_json.get(permission)
+        if response is not None:
+            return response
 
-        return json.dumps(
+        response = orjson.dumps(
             {
                 "githubUsername": "",
                 "isPublic": self.is_public(),
                 "name": self.name,
                 "permission": permission,  # TODO
                 "preferredCompressionMethod": "XZ",
-                "publicSigningKeys": [public_key],
+                "publicSigningKeys": [self.public_key],
                 "uri": self.url,
             }
         )
+        self._cache_json[permission] = response
+        return response
 
     def cache_workspace_dict(self) -> Dict[str, str | bool]:
-        public_key = self.storage.read("key.pub")
-
         return {
             "cacheName": self.name,
             "isPublic": self.is_public(),
-            "publicKey": public_key.split(":")[1],
+            "publicKey": self.public_key.split(":")[1],
         }
 
+    @property
+    def public_key(self) -> str:
+        """Public signing key, read from storage once. Keys don't change after generate_keys."""
+        if self._public_key is None:
+            self._public_key = self.storage.read("key.pub")
+        return self._public_key
+
     def get_store_hashes(self) -> List[str]:
-        return [path[1] for path in self.storage.get_store_paths()]
+        return self.storage.get_store_hashes()
 
     def get_missing_store_hashes(self, hashes: List[str]) -> List[str]:
-        return [
-            store_hash
-            for store_hash in hashes
-            if store_hash not in self.get_store_hashes()
-        ]
+        existing = self.storage.get_existing_store_hashes(hashes)
+        return [store_hash for store_hash in hashes if store_hash not in existing]
 
     def get_paths(self) -> List[StorePathRow]:
         return self.storage.get_store_paths()
@@ -198,7 +270,7 @@ class BinaryCache:
             "storage": str(self.storage),
         }
 
-        self.dht.put(self.id, json.dumps(payload), False)
+        self.dht.submit(self.id, orjson.dumps(payload).decode("utf-8"))
 
     def sync(self) -> None:
         """
@@ -209,11 +281,7 @@ class BinaryCache:
             return
 
         self.advertise()
-        paths = self.storage.get_store_paths()
-
-        for path in paths:
-            store_hash = path[1]
-            self.dht.put(store_hash, self.id)
+        self.dht.put_many([(store_hash, self.id) for store_hash in self.get_store_hashes()])
 
 
     def advertise_periodically(self) -> None:
@@ -231,25 +299,77 @@ class BinaryCache:
 
     def collect_garbage(self) -> None:
         retention = timedelta(days=self.retention)
+        new_file_age = timedelta(seconds=CONSIDERED_NEW_FILE_AGE)
         now = datetime.now(timezone.utc)
 
         healthy_packages: Set[str] = set()
         expired_rows: List[StorePathRow] = []
 
-        for storage in self.storage.storages:
-            for file in storage.list():
-                if file.startswith("key"):
-                    continue
+        # listing is the slow part for remote storages, scan all storages at once
+        storages = self.storage.storages
+        with ThreadPoolExecutor(max(len(storages), 1), thread_name_prefix="gc-scan") as executor:
+            scans = executor.map(lambda storage: self._scan_storage(storage, retention, new_file_age, now), storages)
+            for healthy, expired in scans:
+                healthy_packages.update(healthy)
+                expired_rows.extend(expired)
+
+        # expired packages are kept while a healthy package references them,
+        # spread health over the references of expired packages until nothing changes
+        expired_refs = {f"{row[1]}-{row[2]}": row[8].split(" ") if row[8] else [] for row in expired_rows}
+        pending = [package_name for package_name in expired_refs if package_name in healthy_packages]
+        while pending:
+            for ref in expired_refs.get(pending.pop(), []):
+                if ref not in healthy_packages:
+                    healthy_packages.add(ref)
+                    pending.append(ref)
+
+        removed: List[Tuple[str, str]] = []
+        for row in expired_rows:
+            package_name = f"{row[1]}-{row[2]}"
+            current_storage = self.storage.get_storage(row[9])
+            if not current_storage or package_name in healthy_packages:
+                continue
 
-                created_at = storage.get_file_creation_time(file)
+            print(f"Removing file {package_name} from storage {current_storage.name}")
+            current_storage.remove(f"{row[3]}.nar.xz")
+            removed.append((row[1], row[9]))
+
+        # one commit for all removed paths instead of one per path
+        if removed:
+            self.database.delete_store_paths(removed)
+
+            store_hashes = [store_hash for store_hash, _ in removed]
+            for listener in self.removed_listeners:
+                listener(store_hashes)
+
+    def _scan_storage(
+        self, storage: Storage, retention: timedelta, new_file_age: timedelta, now: datetime
+    ) -> Tuple[Set[str], List[StorePathRow]]:
+        """Remove files without a store path from a storage and sort its store paths by age.
+
+        Returns:
+            Tuple[Set[str], List[StorePathRow]]: packages still within retention together with
+            their references, and rows of the expired store paths
+        """
+        healthy_packages: Set[str] = set()
+        expired_rows: List[StorePathRow] = []
+
+        scanned = (entry for entry in storage.scan() if not entry[0].startswith("key"))
+        # stream the listing in batches, looking up the store paths of a whole batch with one query
+        while files := list(itertools.islice(scanned, GARBAGE_COLLECTION_BATCH_SIZE)):
+            rows = self.database.get_store_path_rows_by_file_hashes(
+                storage.id, [file.split(".")[0] for file, _ in files]
+            )
+
+            for file, created_at in files:
                 if created_at.tzinfo is None:
                     created_at = created_at.replace(tzinfo=timezone.utc)  # always use UTC
 
-                file_hash = file.split(".")[0]
-                row = self.database.get_store_path_row([storage.id], file_hash=file_hash)
+                row = rows.get(file.split(".")[0])
 
                 if not row:
-                    if storage.is_new_file(file):
+                    # the file may still be uploading, its store path isn't saved yet
+                    if now - created_at <= new_file_age:
                         continue
                     print(f"Removing file {file} from storage {storage.name}")
                     storage.remove(file)
@@ -264,34 +384,12 @@ class BinaryCache:
                 else:
                     expired_rows.append(row)
 
-        queue = deque(expired_rows)
-        visited = set()
-
-        while queue:
-            row = queue.popleft()
-            package_name = f"{row[1]}-{row[2]}"
-            refs = row[8].split(" ") if row[8] else []
-            filename = f"{row[3]}.nar.xz"
-            current_storage = self.storage.get_storage(row[9])
-
-            if not current_storage:
-                continue
-
-            if package_name in healthy_packages:
-                healthy_packages.update(refs)
-                continue
-
-            if package_name in visited:
-                print(f"Removing file {package_name} from storage {current_storage.name}")
-                current_storage.remove(filename)
-                self.database.delete_store_path(row[1], row[9])
-            else:
-                visited.add(package_name)
-                queue.append(row)
+        return healthy_packages, expired_rows
 
     def fingerprint(self, references: List[str], store_path: str, nar_hash: str, nar_size: str) -> bytes:
 
-        refs = ",".join(["/nix/store/" + ref for ref in references])
+        # one join without a temporary string per reference
+        refs = "/nix/store/" + ",/nix/store/".join(references) if references else ""
 
         output = f"1;{store_path};{nar_hash};{nar_size};{refs}".encode(
             "utf-8"
@@ -309,20 +407,15 @@ class BinaryCache:
         """
         result: NarInfoDict = {}
 
-        for line in narinfo_str.strip().splitlines():
-            if not line or line.startswith("Sig:"):
+        for key, val in NARINFO_FIELD_RE.findall(narinfo_str):
+            if key == "Sig":
                 continue
 
-            if line.startswith("References:"):
-                refs = line.split(": ", 1)[1]
-                result["References"] = refs.split(" ") if refs and refs != " " else []
+            if key == "References":
+                result["References"] = val.split(" ") if val and val != " " else []
                 continue
 
-            try:
-                key, val = line.split(": ", 1)
-                result[key] = val
-            except ValueError:
-                continue
+            result[key] = val
 
         if all(result[key] or result["References"] == [] for key in result):
             return result
@@ -340,9 +433,7 @@ class BinaryCache:
             Complete signed narinfo text
         """
 
-        content = self.storage.read("key.priv", binary=True).split(b":")
-        prefix = content[0]
-
+        prefix, sk = self.signing_key()
 
         narinfo_dict = self._parse_narinfo_text(narinfo.decode())
         if not narinfo_dict:
@@ -361,12 +452,18 @@ class BinaryCache:
             nar_size,
         )
 
-        sk = ed25519.SigningKey(base64.b64decode(content[1]))
         sig = prefix + b":" + base64.b64encode(sk.sign(fingerprint))
         narinfo_dict["Sig"] = sig.decode("utf-8")
 
         return narinfo_dict
 
+    def signing_key(self) -> Tuple[bytes, ed25519.SigningKey]:
+        """Get the key name and the signing key, key.priv is read only on first use."""
+        if self._signing_key is None:
+            content = self.storage.read("key.priv", binary=True).split(b":")
+            self._signing_key = (content[0], ed25519.SigningKey(base64.b64decode(content[1])))
+        return self._signing_key
+
 
     def generate_keys(self) -> None:
         sk, pk = ed25519.create_keypair()
@@ -378,7 +475,7 @@ class BinaryCache:
             prefix + base64.b64encode(sk.to_bytes()), True
         )
 
-        self.storage.new_file(
-            "key.pub",
-            prefix + base64.b64encode(pk.to_bytes()), True
-        )
+        public_key = prefix + base64.b64encode(pk.to_bytes())
+        self.storage.new_file("key.pub", public_key, True)
+        self._public_key = public_key.decode("utf-8")
+        self._signing_key = (prefix[:-1], sk)
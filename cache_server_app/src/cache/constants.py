@@ -20,8 +20,20 @@ REQUEST_RATE_WEIGHT = 0.3
 LATENCY_WEIGHT = 0.2
 LOAD_SCORE_WEIGHT = 0.8
 
+# REMOTE CACHES
+REMOTE_PROBE_WORKERS = 8 # remote caches probed at once
+REMOTE_PING_TIMEOUT = 2 # seconds, slower remote caches aren't considered
+REMOTE_NARINFO_CACHE_SIZE = 10_000
+REMOTE_NARINFO_CACHE_TTL = 60 # seconds
+
 # ADVERTISING
 ADVERTISING_INTERVAL = 15 # minutes
 
 # GARBAGE COLLECTION
 GARBAGE_COLLECTION_INTERVAL = 12 # hours
+GARBAGE_COLLECTION_BATCH_SIZE = 998 # files looked up with one query, stays under SQLite's variable limit
+
+# LOOKUP
+LOOKUP_CACHE_SIZE = 256
+LOOKUP_CACHE_TTL = 60 # seconds
+STORE_PATH_CACHE_SIZE = 50_000
@@ -9,13 +9,32 @@ Author: Radim Mifka
 Date: 25.4.2025
 """
 
-import json
-import urllib.request
-import urllib.error
+import http.client
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Any, Iterator, Optional, Tuple
+
+import orjson
 
 from cache_server_app.src.cache.base import BinaryCache
-from cache_server_app.src.cache.constants import LATENCY_WEIGHT, LOAD_SCORE_WEIGHT
+from cache_server_app.src.cache.constants import (
+    LATENCY_WEIGHT,
+    LOAD_SCORE_WEIGHT,
+    REMOTE_NARINFO_CACHE_SIZE,
+    REMOTE_NARINFO_CACHE_TTL,
+    REMOTE_PING_TIMEOUT,
+    REMOTE_PROBE_WORKERS,
+)
+from cache_server_app.src.http_pool import HTTPConnectionPool
+from cache_server_app.src.lru import LRUCache
+
+# fields of a served narinfo in the order they are written
+NARINFO_KEYS = (
+    "StorePath", "URL", "Compression", "FileHash", "FileSize",
+    "NarHash", "NarSize", "Deriver", "System", "References", "Sig"
+)
+
 
 class RemoteCacheHelper:
     """Utility class for remote cache operations."""
@@ -23,19 +42,27 @@ class RemoteCacheHelper:
     def __init__(self, cache: BinaryCache) -> None:
         self.cache = cache
         self.cached_paths: dict[str, str] = {}
+        # signed narinfo of remote store paths: store hash -> (narinfo, nar URL, remote cache URL),
+        # kept shortly as the remote cache may remove the path at any time
+        self.narinfos: LRUCache[Tuple[bytes, str, str]] = LRUCache(REMOTE_NARINFO_CACHE_SIZE, REMOTE_NARINFO_CACHE_TTL)
+        # keep-alive connections to remote caches, reused across requests
+        self.pool = HTTPConnectionPool()
+        # remote caches holding a path are probed in parallel
+        self.executor = ThreadPoolExecutor(REMOTE_PROBE_WORKERS, thread_name_prefix="remote-probe")
 
 
     def ping_remote_cache(self, remote_cache_url: str) -> bool:
         """Ping the remote cache to check if it's reachable."""
         remote_url = f"{remote_cache_url}/nix-cache-info"
         try:
-            with urllib.request.urlopen(remote_url) as resp:
+            with self.pool.request("GET", remote_url, REMOTE_PING_TIMEOUT) as resp:
+                resp.read()
                 if resp.status == 200:
                     return True
                 else:
                     print(f"ERROR: Remote cache returned status code {resp.status}")
                     return False
-        except urllib.error.URLError as e:
+        except (http.client.HTTPException, OSError) as e:
             return False
         except Exception as e:
             print(f"ERROR: Unexpected error pinging remote cache: {e}")
@@ -50,64 +77,84 @@ class RemoteCacheHelper:
         best_remote_cache = None
         lowest_score = float('inf')
 
-        for remote_cache_id in remote_cache_ids:
-
-            remote_cache = self.cache.dht.get(remote_cache_id)
-            if not remote_cache or not remote_cache[-1]:
+        # total time is the slowest probe instead of the sum of all of them
+        for probe in self.executor.map(self.probe_remote_cache, remote_cache_ids):
+            if probe is None:
                 continue
 
-            try:
-                remote_cache_info = json.loads(remote_cache[-1])
+            score, remote_cache_info = probe
+            if score < lowest_score:
+                lowest_score = score
+                best_remote_cache = remote_cache_info
 
-                start_time = time.time()
-                alive = self.ping_remote_cache(remote_cache_info.get("url"))
-                if not alive:
-                    continue
+        return best_remote_cache.get("url") if best_remote_cache else None
+
+    def probe_remote_cache(self, remote_cache_id: str) -> Optional[Tuple[float, dict[str, Any]]]:
+        """Look up a remote cache in the DHT and score it by its latency and load.
 
-                latency = (time.time() - start_time) * 1000 # ms
+        Returns:
+            Optional[Tuple[float, dict[str, Any]]]: score (lower is better) and info of the cache,
+                                                    None if the cache is unknown or unreachable
+        """
+        remote_cache = self.cache.dht.get(remote_cache_id)
+        if not remote_cache or not remote_cache[-1]:
+            return None
 
-                # float('inf') is the highest possible value
-                load_score = float('inf')
-                if "metrics" in remote_cache_info:
-                    load_score = remote_cache_info["metrics"].get("load_score", float('inf'))
+        try:
+            remote_cache_info = orjson.loads(remote_cache[-1])
+        except orjson.JSONDecodeError:
+            print(f"ERROR: Invalid JSON in remote cache data for {remote_cache_id}")
+            return None
 
-                score = (latency * LATENCY_WEIGHT) + (load_score * LOAD_SCORE_WEIGHT)
+        start_time = time.perf_counter()
+        alive = self.ping_remote_cache(remote_cache_info.get("url"))
+        if not alive:
+            return None
 
-                if score < lowest_score:
-                    lowest_score = load_score
-                    best_remote_cache = remote_cache_info
+        latency = (time.perf_counter() - start_time) * 1000 # ms
 
-            except json.JSONDecodeError:
-                print(f"ERROR: Invalid JSON in remote cache data for {remote_cache_id}")
-                continue
+        # float('inf') is the highest possible value
+        load_score = float('inf')
+        if "metrics" in remote_cache_info:
+            load_score = remote_cache_info["metrics"].get("load_score", float('inf'))
 
-        return best_remote_cache.get("url") if best_remote_cache else None
+        return (latency * LATENCY_WEIGHT) + (load_score * LOAD_SCORE_WEIGHT), remote_cache_info
 
     def narinfo_dict_to_bytes(self, narinfo_dict: dict) -> bytes:
         """Convert narinfo dictionary to bytes."""
-        ordered_keys = [
-            "StorePath", "URL", "Compression", "FileHash", "FileSize",
-            "NarHash", "NarSize", "Deriver", "System", "References", "Sig"
-        ]
-
-        response = ""
-        for key in ordered_keys:
+        lines = []
+        for key in NARINFO_KEYS:
             value = narinfo_dict.get(key, "")
             if key == "References":
                 value = " ".join(value) if value else " "
-            response += f"{key}: {value}\n"
+            lines.append(f"{key}: {value}\n")
+
+        return "".join(lines).encode()
 
-        return response.encode()
+    def get_cached_narinfo(self, store_hash: str) -> Optional[bytes]:
+        """Get a recently fetched and signed remote narinfo.
+
+        The nar file of the path is made fetchable again, the remote cache of a
+        nar is forgotten once it was downloaded.
+        """
+        cached = self.narinfos.get(store_hash)
+        if cached is None:
+            return None
+
+        narinfo_bytes, file_url, remote_cache_url = cached
+        if file_url:
+            self.cached_paths[file_url] = remote_cache_url
+        return narinfo_bytes
 
     def fetch_and_process_remote_narinfo(self, store_hash: str, remote_cache_url: str) -> tuple[bytes | None, int]:
         """Fetch narinfo from remote cache and process it."""
         try:
             remote_url = f"{remote_cache_url}/{store_hash}.narinfo"
-            with urllib.request.urlopen(remote_url) as resp:
+            with self.pool.request("GET", remote_url) as resp:
+                narinfo_data = resp.read()
                 if resp.status != 200:
+                    print(f"ERROR: Failed to fetch remote narinfo: HTTP Error {resp.status}: {resp.reason}")
                     return None, resp.status
-
-                narinfo_data = resp.read()
                 narinfo_dict = self.cache.sign(narinfo_data)
 
                 file_url: str = narinfo_dict.get("URL") # type: ignore
@@ -115,39 +162,46 @@ class RemoteCacheHelper:
                     self.cached_paths[file_url] = remote_cache_url
 
                 narinfo_bytes = self.narinfo_dict_to_bytes(narinfo_dict)
+                self.narinfos.put(store_hash, (narinfo_bytes, file_url, remote_cache_url))
                 return narinfo_bytes, 200
 
-        except urllib.error.HTTPError as e:
-            print(f"ERROR: Failed to fetch remote narinfo: {e}")
-            return None, e.code
         except Exception as e:
             print(f"ERROR: Unexpected error fetching narinfo: {e}")
             return None, 500
 
-    def fetch_remote_nar_file(self, file_hash: str, compression: str, remote_cache_url: str) -> tuple[bytes | None, int]:
-        """Fetch nar file from remote cache."""
+    @contextmanager
+    def open_remote_nar_file(
+        self, file_hash: str, compression: str, remote_cache_url: str
+    ) -> Iterator[tuple[http.client.HTTPResponse | None, int]]:
+        """Open a nar file in a remote cache as a stream.
+
+        Yields the unread response and 200, or None and the status to respond
+        with if the file can't be fetched. The connection is released when the
+        context exits.
+        """
         nar_path = f"nar/{file_hash}.nar.{compression}"
-        try:
-            remote_url = f"{remote_cache_url}/{nar_path}"
-            with urllib.request.urlopen(remote_url) as resp:
-                if resp.status != 200:
-                    return None, resp.status
+        remote_url = f"{remote_cache_url}/{nar_path}"
 
-                nar_data = resp.read()
+        with ExitStack() as stack:
+            resp: http.client.HTTPResponse | None = None
+            status = 200
+            try:
+                resp = stack.enter_context(self.pool.request("GET", remote_url))
+            except (http.client.HTTPException, OSError) as e:
+                print(f"ERROR: Failed to fetch remote nar file: {e}")
+                status = 502
+            except Exception as e:
+                print(f"ERROR: Unexpected error fetching nar file: {e}")
+                status = 500
 
-                # maybe try to save the file locally to avoid future redirects ???
-                # try:
-                #     self.cache.storage.save(f"{file_hash}.nar.{compression}", nar_data)
-                # except Exception as cache_err:
-                #     print(f"Failed to cache remote nar file locally: {cache_err}")
+            if resp is not None and resp.status != 200:
+                print(f"ERROR: Failed to fetch remote nar file: HTTP Error {resp.status}: {resp.reason}")
+                resp.read()
+                resp, status = None, 502
 
-                if nar_path in self.cached_paths:
-                    self.cached_paths.pop(nar_path)
+            # maybe try to save the file locally to avoid future redirects ???
 
-                return nar_data, 200
-        except urllib.error.URLError as e:
-            print(f"ERROR: Failed to fetch remote nar file: {e}")
-            return None, 502
-        except Exception as e:
-            print(f"ERROR: Unexpected error fetching nar file: {e}")
-            return None, 500
+            if resp is not None and nar_path in self.cached_paths:
+                self.cached_paths.pop(nar_path)
+
+            yield resp, status
@@ -22,6 +22,12 @@ from cache_server_app.src.cache.manager import CacheManager
 from cache_server_app.src.dht.node import DHT
 from cache_server_app.src.workspace import Workspace
 
+# optional faster event loop for the WebSocket server
+try:
+    import uvloop
+except ImportError:
+    uvloop = None # type: ignore
+
 class ServerCommands(BaseCommand):
     """Handles all server-related commands."""
 
@@ -122,7 +128,10 @@ class ServerCommands(BaseCommand):
             except asyncio.CancelledError:
                 pass
 
-        asyncio.run(run_with_cancellation())
+        if uvloop is not None:
+            uvloop.run(run_with_cancellation())
+        else:
+            asyncio.run(run_with_cancellation())
 
     def execute(self, command: str, *args: Any, **kwargs: Any) -> None:
         """Execute the specified server command."""
@@ -164,12 +164,8 @@ class ConfigManager:
 
     def _remove_orphaned_resources(self) -> None:
         """Remove resources that are no longer defined in the configuration."""
-        for cache in BinaryCache.get_rows():
-            name = cache[1]
-            cache_instance = BinaryCache.get(name=name)
-            if not cache_instance:
-                continue
-
+        for cache_instance in BinaryCache.get_all():
+            name = cache_instance.name
             if name not in self.existing_caches:
                 cache_instance.delete()
             else:
@@ -10,13 +10,76 @@ Date: 17.4.2025
 """
 
 import os
+import queue
 import sqlite3
-from typing import Dict, Any, List, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
 
 from cache_server_app.src.cache.access import CacheAccess
 import cache_server_app.src.config.base as config
 from cache_server_app.src.types import BinaryCacheRow, StorageRow, StorePathRow, WorkspaceRow, AgentRow
 
+POOL_SIZE = 8 # idle connections kept open per database file
+MAX_VARIABLES = 999 # lowest SQLITE_MAX_VARIABLE_NUMBER of supported SQLite versions
+PAGE_CACHE_SIZE = -16 * 1024 # per connection, negative values are KiB
+MMAP_SIZE = 256 * 1024 * 1024 # bytes
+
+
+class ConnectionPool:
+    """
+    Pool of SQLite connections shared by all threads of a process.
+
+    Attributes:
+        database_file: path to the database file
+        size: maximum number of idle connections kept open
+    """
+
+    _pools: Dict[Tuple[int, str], "ConnectionPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, database_file: str, size: int = POOL_SIZE) -> None:
+        self.database_file = database_file
+        self.size = size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+
+    @classmethod
+    def get_instance(cls, database_file: str) -> "ConnectionPool":
+        # connections must not be shared with forked cache processes
+        key = (os.getpid(), database_file)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls._pools[key] = cls(database_file)
+            return pool
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_file, check_same_thread=False)
+        # readers don't block the writer and commits don't wait for fsync
+        connection.execute("PRAGMA journal_mode=WAL;")
+        connection.execute("PRAGMA synchronous=NORMAL;")
+        # keep hot pages and temporary tables in memory, read the file through mmap
+        connection.execute("PRAGMA temp_store=MEMORY;")
+        connection.execute(f"PRAGMA cache_size={PAGE_CACHE_SIZE};")
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+        return connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, it is returned to the pool afterwards."""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connect()
+
+        try:
+            yield connection
+        finally:
+            if self._idle.qsize() < self.size:
+                self._idle.put_nowait(connection)
+            else:
+                connection.close()
+
 
 class CacheServerDatabase:
     """
@@ -26,8 +89,20 @@ class CacheServerDatabase:
         database_file: database file specified in the cache-server configuration
     """
 
+    database_file: str
+    _instance: Optional["CacheServerDatabase"] = None
+
+    def __new__(cls) -> "CacheServerDatabase":
+        # the object holds no connection state, so one instance is shared
+        instance = cls._instance
+        if instance is None or instance.database_file != config.database:
+            instance = super().__new__(cls)
+            instance.database_file = config.database
+            cls._instance = instance
+        return instance
+
     def __init__(self) -> None:
-        self.database_file = config.database
+        pass
 
     def create_database(self) -> None:
         if not os.path.exists(self.database_file):
@@ -106,27 +181,31 @@ class CacheServerDatabase:
     # execute statements without returning any value
     def execute_statement(self, statement: str, params: Optional[Tuple[Any, ...]] = None) -> None:
         try:
-            with sqlite3.connect(self.database_file) as db_connection:
-                db_cursor = db_connection.cursor()
-                if params:
-                    db_cursor.execute(statement, params)
-                else:
-                    db_cursor.execute(statement)
-                db_connection.commit()
+            with ConnectionPool.get_instance(self.database_file).connection() as db_connection:
+                with db_connection:
+                    if params:
+                        db_connection.execute(statement, params)
+                    else:
+                        db_connection.execute(statement)
+        except sqlite3.Error as e:
+            print("ERROR: ", e)
+
+    # execute a statement for each set of params in a single transaction
+    def execute_many(self, statement: str, params: List[Tuple[Any, ...]]) -> None:
+        try:
+            with ConnectionPool.get_instance(self.database_file).connection() as db_connection:
+                with db_connection:
+                    db_connection.executemany(statement, params)
         except sqlite3.Error as e:
             print("ERROR: ", e)
 
     # execute SQL selects with list of results
     def execute_select(self, statement: str, params: Optional[Tuple[Any, ...]] = None) -> list[Any]:
         try:
-            with sqlite3.connect(self.database_file) as db_connection:
-                db_cursor = db_connection.cursor()
+            with ConnectionPool.get_instance(self.database_file).connection() as db_connection:
                 if params:
-                    result = db_cursor.execute(statement, params).fetchall()
-                else:
-                    result = db_cursor.execute(statement).fetchall()
-                db_connection.commit()
-            return result
+                    return db_connection.execute(statement, params).fetchall()
+                return db_connection.execute(statement).fetchall()
         except sqlite3.Error as e:
             print("ERROR: ", e)
             return []
@@ -282,6 +361,32 @@ class CacheServerDatabase:
 
         return {row[0]: row[1] for row in db_result}
 
+    def get_caches_storages(self, cache_ids: Optional[List[str]] = None) -> Dict[str, List[Tuple[StorageRow, Dict[str, str]]]]:
+        """Get storages with their configs grouped by cache id, all caches if cache_ids is None."""
+        statement = """
+            SELECT storage.id, storage.name, storage.type, storage.root, storage.cache_id,
+                   storage_config.config_key, storage_config.config_value
+            FROM storage
+            LEFT JOIN storage_config ON storage_config.storage_id = storage.id
+            """
+        params: Tuple[str, ...] = ()
+        if cache_ids is not None:
+            if not cache_ids:
+                return {}
+            statement += f"WHERE storage.cache_id IN ({', '.join('?' for _ in cache_ids)})"
+            params = tuple(cache_ids)
+
+        caches: Dict[str, List[Tuple[StorageRow, Dict[str, str]]]] = {}
+        storages: Dict[str, Dict[str, str]] = {}
+        for row in self.execute_select(statement + ";", params):
+            storage_id = row[0]
+            if storage_id not in storages:
+                storages[storage_id] = {}
+                caches.setdefault(row[4], []).append((row[:5], storages[storage_id]))
+            if row[5] is not None:
+                storages[storage_id][row[5]] = row[6]
+        return caches
+
     def get_private_cache_list(self) -> List[BinaryCacheRow]:
         statement = """
             SELECT * FROM binary_cache
@@ -369,6 +474,17 @@ class CacheServerDatabase:
 
         return row
 
+    def get_agent_rows(self, names: List[str]) -> List[AgentRow]:
+        if not names:
+            return []
+
+        placeholders = ', '.join('?' for _ in names)
+        statement = f"""
+            SELECT * FROM agent
+            WHERE name IN ({placeholders})
+            ;"""
+        return self.execute_select(statement, tuple(names))
+
     def get_agents(self) -> List[AgentRow]:
         statement = """
             SELECT * FROM agent
@@ -411,6 +527,52 @@ class CacheServerDatabase:
             ;"""
         return self.execute_select(statement, tuple(storage_ids))
 
+    def get_store_hashes(self, storage_ids: List[str]) -> List[str]:
+        if not storage_ids:
+            return []
+
+        placeholders = ', '.join('?' for _ in storage_ids)
+        statement = f"""
+            SELECT store_hash FROM store_path
+            WHERE storage_id IN ({placeholders})
+            ;"""
+        return [row[0] for row in self.execute_select(statement, tuple(storage_ids))]
+
+    def get_existing_store_hashes(self, storage_ids: List[str], store_hashes: List[str]) -> Set[str]:
+        if not storage_ids or not store_hashes:
+            return set()
+
+        storage_placeholders = ', '.join('?' for _ in storage_ids)
+        # clients ask about thousands of hashes at once, stay under the variable limit
+        batch_size = max(MAX_VARIABLES - len(storage_ids), 1)
+
+        existing: Set[str] = set()
+        for start in range(0, len(store_hashes), batch_size):
+            batch = store_hashes[start:start + batch_size]
+            hash_placeholders = ', '.join('?' for _ in batch)
+            statement = f"""
+                SELECT store_hash FROM store_path
+                WHERE storage_id IN ({storage_placeholders})
+                AND store_hash IN ({hash_placeholders})
+                ;"""
+            existing.update(row[0] for row in self.execute_select(statement, (*storage_ids, *batch)))
+        return existing
+
+    def get_store_path_rows_by_file_hashes(self, storage_id: str, file_hashes: List[str]) -> Dict[str, StorePathRow]:
+        rows: Dict[str, StorePathRow] = {}
+        batch_size = MAX_VARIABLES - 1
+        for start in range(0, len(file_hashes), batch_size):
+            batch = file_hashes[start:start + batch_size]
+            placeholders = ', '.join('?' for _ in batch)
+            statement = f"""
+                SELECT * FROM store_path
+                WHERE storage_id=?
+                AND file_hash IN ({placeholders})
+                ;"""
+            for row in self.execute_select(statement, (storage_id, *batch)):
+                rows.setdefault(row[3], row)
+        return rows
+
     def get_store_path_row(
         self, storage_ids: List[str], store_hash: str = "", file_hash: str = ""
     ) -> Optional[StorePathRow]:
@@ -504,6 +666,15 @@ class CacheServerDatabase:
             ;"""
         self.execute_statement(statement, (store_hash, storage_id))
 
+    def delete_store_paths(self, store_paths: List[Tuple[str, str]]) -> None:
+        """Delete store paths given as (store hash, storage id) in one transaction."""
+        statement = """
+            DELETE FROM store_path
+            WHERE store_hash=?
+            AND storage_id=?
+            ;"""
+        self.execute_many(statement, store_paths)
+
     def insert_workspace(
         self, workspace_id: str, name: str, token: str, cache_id: str
     ) -> None:
@@ -9,16 +9,28 @@ Author: Radim Mifka
 Date: 22.4.2025
 """
 
-import json
-import urllib.request
-import urllib.error
+import http.client
+import queue
+import threading
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import orjson
 import cache_server_app.src.config.base as config
-from typing import List
+from typing import List, Optional, Tuple
+
+PUT_WORKERS = 16 # puts sent at once by put_many
+SUBMIT_QUEUE_SIZE = 10_000 # puts waiting for the background worker
+SUBMIT_BATCH_SIZE = 256 # puts sent by the background worker at once
+SUBMIT_BATCH_WAIT = 0.1 # seconds the background worker waits to fill a batch
 
 class DHTClient:
     """
     Client class to connect to the central DHT service.
+
+    Each thread keeps one persistent HTTP/1.1 connection to the server,
+    so consecutive calls don't pay for a new TCP handshake.
     """
     _instance = None
 
@@ -29,7 +41,42 @@ class DHTClient:
         return cls._instance
 
     def __init__(self) -> None:
-        self.base_url = f"http://{config.server_hostname}:{config.server_port}/api/v1/dht"
+        self.base_path = "/api/v1/dht"
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(PUT_WORKERS, thread_name_prefix="dht-put")
+        self._submitted: queue.Queue[Tuple[str, str]] = queue.Queue(SUBMIT_QUEUE_SIZE)
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        """
+        Send a request over the thread's persistent connection.
+
+        A connection closed by the server while idle is reopened and the
+        request is sent once more.
+
+        Returns:
+            Tuple[int, bytes]: status code and response body
+        """
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+
+        for attempt in range(2):
+            connection: Optional[http.client.HTTPConnection] = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = http.client.HTTPConnection(config.server_hostname, config.server_port)
+                self._local.connection = connection
+
+            try:
+                connection.request(method, f"{self.base_path}{path}", body, headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+        raise http.client.HTTPException("unreachable")
 
     def put(self, key: str, value: str, permanent: bool = False) -> None:
         """
@@ -45,19 +92,69 @@ class DHTClient:
         if config.standalone:
             return None
 
-        data = json.dumps({"key": key, "value": value, "permanent": permanent}).encode("utf-8")
-        req = urllib.request.Request(
-            f"{self.base_url}/put",
-            data=data,
-            headers={"Content-Type": "application/json"}
-        )
+        data = orjson.dumps({"key": key, "value": value, "permanent": permanent})
         try:
-            with urllib.request.urlopen(req) as response:
-                if response.status != 200:
-                    print(f"ERROR: Failed to put value into DHT. Status code: {response.status}")
-        except urllib.error.URLError as e:
+            status, _ = self._request("POST", "/put", data)
+            if status != 200:
+                print(f"ERROR: Failed to put value into DHT. Status code: {status}")
+        except (http.client.HTTPException, OSError) as e:
             print(f"ERROR: Error putting value in DHT: {e}")
 
+    def put_many(self, items: List[Tuple[str, str]], permanent: bool = False) -> None:
+        """
+        Put many values into the DHT concurrently.
+
+        Blocks until all values are sent. Every worker thread sends its puts
+        over its own persistent connection.
+
+        Args:
+            items: (key, value) pairs to put
+            permanent: same as in put
+        """
+
+        if config.standalone or not items:
+            return None
+
+        wait([self._executor.submit(self.put, key, value, permanent) for key, value in items])
+
+    def submit(self, key: str, value: str) -> None:
+        """
+        Put a value into the DHT in the background.
+
+        Returns right away, a worker thread sends the submitted values in batches.
+        Blocks only while the queue of waiting values is full.
+
+        Args:
+            key: Key to put
+            value: Value to put
+        """
+
+        if config.standalone:
+            return None
+
+        with self._worker_lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._send_submitted, name="dht-submit", daemon=True)
+                self._worker.start()
+
+        self._submitted.put((key, value))
+
+    def _send_submitted(self) -> None:
+        """Send submitted values, waiting up to SUBMIT_BATCH_WAIT to fill a batch."""
+        while True:
+            batch = [self._submitted.get()]
+            deadline = time.monotonic() + SUBMIT_BATCH_WAIT
+            while len(batch) < SUBMIT_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._submitted.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self.put_many(batch)
+
     def get(self, key: str) -> List[str] | None:
         """
         Get a value from the DHT.
@@ -73,13 +170,13 @@ class DHTClient:
             return None
 
         try:
-            with urllib.request.urlopen(f"{self.base_url}/get/{urllib.parse.quote(key)}") as response:
-                if response.status == 200:
-                    data = json.loads(response.read().decode("utf-8"))
-                    value: List[str] | None = data.get("value")
-                    if value is not None:
-                        return value
-        except urllib.error.URLError as e:
+            status, body = self._request("GET", f"/get/{urllib.parse.quote(key)}")
+            if status == 200:
+                data = orjson.loads(body)
+                value: List[str] | None = data.get("value")
+                if value is not None:
+                    return value
+        except (http.client.HTTPException, OSError) as e:
             print(f"Error getting value from DHT: {e}")
 
         return None
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3.12
+"""
+http_pool
+
+Module containing a pool of persistent HTTP connections to other servers.
+
+Author: Radim Mifka
+
+Date: 16.10.2026
+"""
+
+import http.client
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+POOL_SIZE = 16 # idle connections kept per host
+TIMEOUT = 30 # seconds
+
+ConnectionKey = Tuple[str, str, Optional[int]]
+
+
+class HTTPConnectionPool:
+    """
+    Thread-safe pool of keep-alive HTTP(S) connections, grouped by host.
+
+    Attributes:
+        size: maximum number of idle connections kept per host
+        timeout: socket timeout of the connections
+    """
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = TIMEOUT) -> None:
+        self.size = size
+        self.timeout = timeout
+        self._idle: Dict[ConnectionKey, List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, key: ConnectionKey) -> Tuple[http.client.HTTPConnection, bool]:
+        """Get an idle connection to the host or open a new one.
+
+        Returns:
+            Tuple[http.client.HTTPConnection, bool]: connection and whether it was reused
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def _release(self, key: ConnectionKey, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _set_timeout(connection: http.client.HTTPConnection, timeout: float) -> None:
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+
+    @contextmanager
+    def request(self, method: str, url: str, timeout: Optional[float] = None) -> Iterator[http.client.HTTPResponse]:
+        """Send a request and yield the response.
+
+        The connection goes back to the pool if the response was read whole,
+        otherwise it is closed. A reused connection that the server closed
+        while idle is replaced and the request is sent once more.
+
+        Args:
+            method: HTTP method
+            url: absolute URL of the resource
+            timeout: socket timeout for this request only, the pool's timeout if None
+        """
+        parsed = urllib.parse.urlsplit(url)
+        key: ConnectionKey = (parsed.scheme, parsed.hostname or "", parsed.port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+
+        while True:
+            connection, reused = self._acquire(key)
+            self._set_timeout(connection, timeout if timeout is not None else self.timeout)
+            try:
+                connection.request(method, path)
+                response = connection.getresponse()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                # a slow server isn't a stale connection, don't wait for it twice
+                if not reused or isinstance(e, TimeoutError):
+                    raise
+
+        try:
+            yield response
+        finally:
+            if response.isclosed() and not response.will_close:
+                self._set_timeout(connection, self.timeout)
+                self._release(key, connection)
+            else:
+                connection.close()
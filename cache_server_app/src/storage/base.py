@@ -11,7 +11,7 @@ Date: 5.12.2024
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List, Literal, Optional, overload
+from typing import BinaryIO, Dict, Iterator, List, Literal, Optional, Tuple, overload
 import os
 
 
@@ -102,6 +102,17 @@ class Storage(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def save_stream(self, path: str, stream: BinaryIO, length: int) -> None:
+        """Save data read from a stream to a file without buffering it whole.
+
+        Parameters:
+            path (str): The path to the file from the root directory.
+            stream (BinaryIO): The stream to read the data from.
+            length (int): The number of bytes to read from the stream.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def remove(self, path: str) -> None:
         """Remove a file.
@@ -138,6 +149,18 @@ class Storage(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def open(self, path: str) -> Tuple[BinaryIO, int]:
+        """Open a file for streaming its contents.
+
+        Parameters:
+            path (str): The path to the file from the root directory.
+
+        Returns:
+            Tuple[BinaryIO, int]: The binary stream and the size of the file in bytes.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def rename(self, path: str, new_name: str) -> None:
         """Rename a file.
@@ -157,6 +180,17 @@ class Storage(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def scan(self) -> Iterator[Tuple[str, datetime]]:
+        """Iterate over all files in the root directory together with their creation times.
+
+        Files are listed lazily, the whole listing is never held in memory.
+
+        Returns:
+            Iterator[Tuple[str, datetime]]: File names and their creation times.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def get_file_creation_time(self, path: str) -> datetime:
         """Get the creation time of a file.
@@ -195,6 +229,18 @@ class Storage(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        """Check if a file exists, without listing the root directory.
+
+        Parameters:
+            path (str): The path to the file from the root directory.
+
+        Returns:
+            bool: True if the file exists, False otherwise.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def get_available_space(self) -> int:
         """Get the available space in bytes.
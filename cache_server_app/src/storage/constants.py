@@ -11,6 +11,8 @@ Date: 28.4.2025
 # storage
 MAX_STORAGE_USAGE = 0.95
 CONSIDERED_NEW_FILE_AGE = 3600  # seconds
+PENDING_UPLOADS_SIZE = 10_000  # uploads remembered by the storage manager until completed
+CHUNK_SIZE = 1 << 20  # bytes copied at once when streaming files
 
 # local storage
 DIR_PERMISSIONS = 0o755
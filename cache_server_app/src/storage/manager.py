@@ -11,17 +11,24 @@ Date: 3.4.2025
 
 import uuid
 import os
-import json
+import orjson
 
-from typing import Dict, List, Literal, Optional, Tuple, overload
+from typing import Dict, List, Literal, Optional, Set, Tuple, overload
 from cache_server_app.src.storage.base import Storage
 from cache_server_app.src.database import CacheServerDatabase
 from cache_server_app.src.storage.factory import StorageFactory
 from cache_server_app.src.storage.type import StorageType
 from cache_server_app.src.types import StorePathRow
 from cache_server_app.src.storage.strategies import Strategy
+from cache_server_app.src.storage.constants import CONSIDERED_NEW_FILE_AGE, PENDING_UPLOADS_SIZE
+from cache_server_app.src.lru import LRUCache
 
 class StorageManager:
+    # uploads created by new_file and not yet completed: (cache id, name without extension) -> (file name, storage id),
+    # shared by all managers of the process since cache objects are recreated,
+    # abandoned uploads expire once garbage collection may remove their files
+    _pending: LRUCache[Tuple[str, str]] = LRUCache(PENDING_UPLOADS_SIZE, CONSIDERED_NEW_FILE_AGE)
+
     def __init__(self, cache_id: str, storages: List[Storage], strategy: str, strategy_state: dict = {}, database: Optional[CacheServerDatabase] = None) -> None:
         self.cache_id = cache_id
         self.storages = storages
@@ -45,6 +52,14 @@ class StorageManager:
         storage_ids = [storage.id for storage in self.storages]
         return self.database.get_store_paths(storage_ids)
 
+    def get_store_hashes(self) -> List[str]:
+        storage_ids = [storage.id for storage in self.storages]
+        return self.database.get_store_hashes(storage_ids)
+
+    def get_existing_store_hashes(self, store_hashes: List[str]) -> Set[str]:
+        storage_ids = [storage.id for storage in self.storages]
+        return self.database.get_existing_store_hashes(storage_ids, store_hashes)
+
     def get_store_path(self, store_hash: str = "", file_hash: str = "") -> StorePathRow | None:
         storage_ids = [storage.id for storage in self.storages]
         return self.database.get_store_path_row(storage_ids, store_hash, file_hash)
@@ -91,11 +106,12 @@ class StorageManager:
         # this could be probbly moved to some part when the server is stopped
         # not really needed to be done every time when the storage is chosen
         # because the instance holds the state itself
-        self.database.update_storage_strategy_state(self.cache_id, self.strategy, json.dumps(self.strategy_state))
+        self.database.update_storage_strategy_state(self.cache_id, self.strategy, orjson.dumps(self.strategy_state).decode("utf-8"))
 
         return storage
 
-    def new_file(self, path: str, data: bytes = b"", all: bool = False) -> None:
+    def new_file(self, path: str, data: bytes = b"", all: bool = False, upload: bool = False) -> None:
+        """Create a file, the storage of an upload is remembered for find until it is released."""
         if all:
             for storage in self.storages:
                 storage.new_file(path, data)
@@ -104,6 +120,9 @@ class StorageManager:
         storage = self._choose_storage()
         storage.new_file(path, data)
 
+        if upload:
+            StorageManager._pending.put((self.cache_id, path.split(".", 1)[0]), (path, storage.id))
+
     @overload
     def read(self, path: str, binary: Literal[True]) -> bytes: ...
 
@@ -123,12 +142,24 @@ class StorageManager:
             return storage.read(path, False)
 
     def find(self, path: str) -> Optional[Tuple[str, Storage]]:
+        pending = StorageManager._pending.get((self.cache_id, path))
+        if pending:
+            storage = self.get_storage(id=pending[1])
+            # garbage collection in the cache process may have removed the file
+            if storage and storage.exists(pending[0]):
+                return pending[0], storage
+            StorageManager._pending.invalidate((self.cache_id, path))
+
         for storage in self.storages:
             finding = storage.find(path)
             if finding:
                 return finding, storage
         return None
 
+    def release(self, name: str) -> None:
+        """Forget a file created by new_file once it was completed or aborted."""
+        StorageManager._pending.invalidate((self.cache_id, name))
+
     def remove(self, path: str) -> None:
         storage = self._choose_storage()
         storage.remove(path)
@@ -9,13 +9,14 @@ Date: 5.12.2024
 """
 
 import os
-from typing import Dict
+import uuid
+from typing import BinaryIO, Dict, Iterator, Tuple
 from datetime import datetime, timezone
 
 from cache_server_app.src.storage.base import Storage, StorageConfig
 from cache_server_app.src.storage.registry import StorageRegistry
 from cache_server_app.src.storage.type import StorageType
-from cache_server_app.src.storage.constants import CONSIDERED_NEW_FILE_AGE, DIR_PERMISSIONS, MAX_STORAGE_USAGE
+from cache_server_app.src.storage.constants import CHUNK_SIZE, CONSIDERED_NEW_FILE_AGE, DIR_PERMISSIONS, MAX_STORAGE_USAGE
 
 @StorageRegistry.register(StorageType.LOCAL)
 class LocalStorage(Storage):
@@ -57,6 +58,27 @@ class LocalStorage(Storage):
         with open(path, "wb") as f:
             f.write(data)
 
+    def save_stream(self, path: str, stream: BinaryIO, length: int) -> None:
+        path = os.path.join(self.storage_path, path)
+        # write under a temporary name unrelated to the file so find() never
+        # returns a partial file, it is moved in place once complete
+        temporary_path = os.path.join(self.storage_path, f".{uuid.uuid4().hex}.part")
+        # one buffer reused for the whole upload instead of a new bytes per chunk
+        buffer = memoryview(bytearray(min(CHUNK_SIZE, length)))
+        try:
+            with open(temporary_path, "wb") as f:
+                while length > 0:
+                    read = stream.readinto(buffer[:min(len(buffer), length)]) # type: ignore[attr-defined]
+                    if not read:
+                        raise IOError(f"Unexpected end of stream while saving {path}")
+                    f.write(buffer[:read])
+                    length -= read
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
     def remove(self, path: str) -> None:
         path = os.path.join(self.storage_path, path)
         os.remove(path)
@@ -73,6 +95,11 @@ class LocalStorage(Storage):
         with open(path, "rb" if binary else "r") as f:
             return f.read()
 
+    def open(self, path: str) -> Tuple[BinaryIO, int]:
+        path = os.path.join(self.storage_path, path)
+        f = open(path, "rb")
+        return f, os.fstat(f.fileno()).st_size
+
     def rename(self, path: str, new_name: str) -> None:
         path = os.path.join(self.storage_path, path)
         new_path = os.path.join(self.storage_path, new_name)
@@ -82,6 +109,13 @@ class LocalStorage(Storage):
     def list(self) -> list[str]:
         return os.listdir(self.storage_path)
 
+    def scan(self) -> Iterator[Tuple[str, datetime]]:
+        # stat results come with the directory entries, no path joining per file
+        with os.scandir(self.storage_path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.name, datetime.fromtimestamp(entry.stat().st_mtime, tz=timezone.utc)
+
     def get_file_creation_time(self, path: str) -> datetime:
         path = os.path.join(self.storage_path, path)
         file_mod_time = os.path.getmtime(path)
@@ -102,6 +136,9 @@ class LocalStorage(Storage):
                 return file
         return None
 
+    def exists(self, path: str) -> bool:
+        return os.path.isfile(os.path.join(self.storage_path, path))
+
     def get_available_space(self) -> int:
         """Get the available space in bytes."""
         statvfs = os.statvfs(self.storage_path)
@@ -9,7 +9,7 @@ Date: 5.12.2024
 """
 
 import os
-from typing import Dict
+from typing import BinaryIO, Dict, Iterator, Tuple
 from datetime import datetime, timezone
 
 import boto3
@@ -22,6 +22,21 @@ from cache_server_app.src.storage.type import StorageType
 from cache_server_app.src.storage.constants import CONSIDERED_NEW_FILE_AGE
 
 
+class BoundedReader:
+    """Reader returning at most length bytes from the wrapped stream."""
+
+    def __init__(self, stream: BinaryIO, length: int) -> None:
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
 @StorageRegistry.register(StorageType.S3)
 class S3Storage(Storage):
     @classmethod
@@ -82,6 +97,15 @@ class S3Storage(Storage):
         except ClientError as e:
             raise IOError(f"Error saving file {path}: {e}")
 
+    def save_stream(self, path: str, stream: BinaryIO, length: int) -> None:
+        full_path = os.path.join(self.storage_path, path).lstrip("/")
+
+        try:
+            # upload_fileobj reads in parts, so the stream is never buffered whole
+            self.s3_client.upload_fileobj(BoundedReader(stream, length), self.bucket, full_path)
+        except ClientError as e:
+            raise IOError(f"Error saving file {path}: {e}")
+
     def remove(self, path: str) -> None:
         full_path = os.path.join(self.storage_path, path).lstrip("/")
 
@@ -110,6 +134,15 @@ class S3Storage(Storage):
         except ClientError as e:
             raise IOError(f"Error reading file {path}: {e}")
 
+    def open(self, path: str) -> Tuple[BinaryIO, int]:
+        full_path = os.path.join(self.storage_path, path).lstrip("/")
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=full_path)
+            return response["Body"], response["ContentLength"]
+        except ClientError as e:
+            raise IOError(f"Error opening file {path}: {e}")
+
     def rename(self, path: str, new_name: str) -> None:
         full_old_path = os.path.join(self.storage_path, path).lstrip("/")
         full_new_path = os.path.join(self.storage_path, new_name).lstrip("/")
@@ -139,6 +172,21 @@ class S3Storage(Storage):
         except ClientError as e:
             raise IOError(f"Error listing files: {e}")
 
+    def scan(self) -> Iterator[Tuple[str, datetime]]:
+        # the listing already carries LastModified, no head_object per file,
+        # pages of up to 1000 objects are fetched as they are consumed
+        try:
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.storage_path):
+                for obj in page.get("Contents", []):
+                    if obj["Key"] != self.storage_path:
+                        yield (
+                            obj["Key"][len(self.storage_path) :],
+                            datetime.fromtimestamp(obj["LastModified"].timestamp(), tz=timezone.utc),
+                        )
+        except ClientError as e:
+            raise IOError(f"Error listing files: {e}")
+
     def get_file_creation_time(self, path: str) -> datetime:
         full_path = os.path.join(self.storage_path, path).lstrip("/")
 
@@ -150,6 +198,15 @@ class S3Storage(Storage):
         except ClientError as e:
             raise IOError(f"Error getting file creation time for {path}: {e}")
 
+    def exists(self, path: str) -> bool:
+        full_path = os.path.join(self.storage_path, path).lstrip("/")
+
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=full_path)
+            return True
+        except ClientError:
+            return False
+
     def is_new_file(self, path: str) -> bool:
         try:
             file_mod_time = self.get_file_creation_time(path)
@@ -16,8 +16,10 @@ from cache_server_app.src.storage.base import Storage
 import ed25519
 
 from cache_server_app.src.cache.base import BinaryCache
+from cache_server_app.src.cache.constants import LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, STORE_PATH_CACHE_SIZE
 from cache_server_app.src.database import CacheServerDatabase
-from typing import Optional
+from cache_server_app.src.lru import LRUCache
+from typing import Optional, Tuple
 from cache_server_app.src.storage.type import StorageType
 
 
@@ -40,6 +42,11 @@ class StorePath:
         storage: storage object
     """
 
+    # store paths looked up by (cache name, store hash, file hash), shared by all request handler threads
+    _by_hash: LRUCache["StorePath"] = LRUCache(STORE_PATH_CACHE_SIZE, LOOKUP_CACHE_TTL)
+    # key name and signing key by storage id, keys don't change once generated
+    _signing_keys: LRUCache[Tuple[bytes, ed25519.SigningKey]] = LRUCache(LOOKUP_CACHE_SIZE)
+
     def __init__(
         self,
         id: str,
@@ -112,6 +119,17 @@ class StorePath:
 
     @staticmethod
     def get(cache_name: str, store_hash: str = "", file_hash: str = "") -> Optional["StorePath"]:
+        # only found paths are memoized, so a newly pushed path shows up immediately
+        key = (cache_name, store_hash, file_hash)
+        path = StorePath._by_hash.get(key)
+        if path is None:
+            path = StorePath._get(cache_name, store_hash, file_hash)
+            if path:
+                StorePath._by_hash.put(key, path)
+        return path
+
+    @staticmethod
+    def _get(cache_name: str, store_hash: str = "", file_hash: str = "") -> Optional["StorePath"]:
         cache = BinaryCache.get(name=cache_name)
         if not cache:
             return None
@@ -159,21 +177,31 @@ Sig: {self.signature()}
         return narinfo_dict
 
     def fingerprint(self) -> bytes:
-        refs = ",".join(["/nix/store/" + ref for ref in self.references])
+        # one join without a temporary string per reference
+        refs = "/nix/store/" + ",/nix/store/".join(self.references) if self.references else ""
         output = f"1;/nix/store/{self.store_hash}-{self.store_suffix};{self.nar_hash};{self.nar_size};{refs}".encode(
             "utf-8"
         )
         return output
 
     def signature(self) -> str:
-        content = self.storage.read("key.priv", binary=True).split(b":")
-        prefix = content[0]
+        signing_key = StorePath._signing_keys.get(self.storage.id)
+        if signing_key is None:
+            content = self.storage.read("key.priv", binary=True).split(b":")
+            signing_key = (content[0], ed25519.SigningKey(base64.b64decode(content[1])))
+            StorePath._signing_keys.put(self.storage.id, signing_key)
 
-        sk = ed25519.SigningKey(base64.b64decode(content[1]))
+        prefix, sk = signing_key
         sig = prefix + b":" + base64.b64encode(sk.sign(self.fingerprint()))
         return sig.decode("utf-8")
 
+    @staticmethod
+    def clear_lookups() -> None:
+        """Forget memoized lookups, store paths were removed without delete()."""
+        StorePath._by_hash.clear()
+
     def save(self) -> None:
+        StorePath._by_hash.clear()
         self.database.insert_store_path(
             self.id,
             self.store_hash,
@@ -188,4 +216,5 @@ Sig: {self.signature()}
         )
 
     def delete(self) -> None:
+        StorePath._by_hash.clear()
         self.database.delete_store_path(self.store_hash, self.storage.id)
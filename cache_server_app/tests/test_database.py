@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.12
+"""
+test_database
+
+Module created to test the SQLite connection pool and batched queries.
+
+Author: Radim Mifka
+Date: 16.10.2026
+"""
+
+import os
+import pathlib
+from typing import Iterator
+
+import pytest
+
+import cache_server_app.src.config.base as config
+from cache_server_app.src.database import MAX_VARIABLES, CacheServerDatabase, ConnectionPool
+
+
+@pytest.fixture()
+def database(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[CacheServerDatabase]:
+    monkeypatch.setattr(config, "database", os.path.join(tmp_path, "db.sqlite"))
+    database = CacheServerDatabase()
+    database.create_database()
+    yield database
+
+
+def insert_store_paths(database: CacheServerDatabase, storage_id: str, count: int) -> None:
+    database.execute_many(
+        "INSERT INTO store_path VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+        [
+            (f"id{i}", f"hash{i}", "suffix", f"file{i}", 1, "narhash", 1, "", "", storage_id)
+            for i in range(count)
+        ],
+    )
+
+#### connection pool tests ####
+
+def test_pool_shared_per_file(tmp_path: pathlib.Path) -> None:
+    first = os.path.join(tmp_path, "first.sqlite")
+    second = os.path.join(tmp_path, "second.sqlite")
+
+    assert ConnectionPool.get_instance(first) is ConnectionPool.get_instance(first)
+    assert ConnectionPool.get_instance(first) is not ConnectionPool.get_instance(second)
+
+def test_pool_reuses_connections(tmp_path: pathlib.Path) -> None:
+    pool = ConnectionPool.get_instance(os.path.join(tmp_path, "db.sqlite"))
+
+    with pool.connection() as connection:
+        first = connection
+    with pool.connection() as connection:
+        assert connection is first
+
+def test_pool_keeps_at_most_size_idle(tmp_path: pathlib.Path) -> None:
+    pool = ConnectionPool(os.path.join(tmp_path, "db.sqlite"), size=1)
+
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+
+    assert pool._idle.qsize() == 1
+
+def test_pool_not_shared_with_forked_process(database: CacheServerDatabase) -> None:
+    parent_pool = ConnectionPool.get_instance(database.database_file)
+    with parent_pool.connection() as connection:
+        parent_connection = connection
+
+    pid = os.fork()
+    if pid == 0:
+        # child, report through the exit code, pytest must not continue here
+        status = 1
+        try:
+            pool = ConnectionPool.get_instance(database.database_file)
+            with pool.connection() as connection:
+                reused = pool is parent_pool or connection is parent_connection
+                connection.execute("SELECT * FROM binary_cache;")
+            status = 1 if reused else 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+
+    # the parent keeps its own pool and connection
+    with ConnectionPool.get_instance(database.database_file).connection() as connection:
+        assert connection is parent_connection
+
+#### batched query tests ####
+
+def test_existing_store_hashes_over_variable_limit(database: CacheServerDatabase) -> None:
+    count = MAX_VARIABLES * 2 + 500
+    insert_store_paths(database, "storage", count)
+    asked = [f"hash{i}" for i in range(0, count, 2)] + [f"missing{i}" for i in range(MAX_VARIABLES)]
+
+    existing = database.get_existing_store_hashes(["storage", "other"], asked)
+
+    assert existing == {f"hash{i}" for i in range(0, count, 2)}
+
+def test_existing_store_hashes_other_storage(database: CacheServerDatabase) -> None:
+    insert_store_paths(database, "storage", 10)
+
+    assert database.get_existing_store_hashes(["other"], [f"hash{i}" for i in range(10)]) == set()
+
+def test_existing_store_hashes_empty(database: CacheServerDatabase) -> None:
+    assert database.get_existing_store_hashes(["storage"], []) == set()
+    assert database.get_existing_store_hashes([], ["hash0"]) == set()
+
+def test_store_path_rows_by_file_hashes_over_variable_limit(database: CacheServerDatabase) -> None:
+    count = MAX_VARIABLES + 10
+    insert_store_paths(database, "storage", count)
+
+    rows = database.get_store_path_rows_by_file_hashes("storage", [f"file{i}" for i in range(count)])
+
+    assert len(rows) == count
+    assert rows[f"file{count - 1}"][1] == f"hash{count - 1}"
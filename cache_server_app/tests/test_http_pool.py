@@ -0,0 +1,167 @@
+#!/usr/bin/env python3.12
+"""
+test_http_pool
+
+Module created to test the pool of persistent HTTP connections.
+
+Author: Radim Mifka
+Date: 16.10.2026
+"""
+
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Tuple
+
+import pytest
+
+from cache_server_app.src.http_pool import HTTPConnectionPool
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Keep-alive handler recording the client port and path of every request."""
+
+    protocol_version = "HTTP/1.1"
+    requests: List[Tuple[int, str]] = []
+
+    def do_GET(self) -> None:
+        self.requests.append((self.client_address[1], self.path))
+        if self.path == "/slow":
+            time.sleep(1)
+        body = b"error" if self.path == "/error" else b"x" * 1024
+        self.send_response(500 if self.path == "/error" else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == "/close":
+            # drop the connection without announcing it, like an idle timeout
+            self.close_connection = True
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture()
+def server() -> Iterator[str]:
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def idle_count(pool: HTTPConnectionPool) -> int:
+    return sum(len(idle) for idle in pool._idle.values())
+
+def ports() -> List[int]:
+    return [port for port, _ in Handler.requests]
+
+
+def test_connection_reused(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    for _ in range(3):
+        with pool.request("GET", f"{server}/file") as response:
+            assert response.status == 200
+            assert response.read() == b"x" * 1024
+
+    assert len(set(ports())) == 1
+    assert idle_count(pool) == 1
+
+def test_query_sent(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    with pool.request("GET", f"{server}/file?a=b") as response:
+        response.read()
+
+    assert Handler.requests[0][1] == "/file?a=b"
+
+def test_reconnect_after_server_closed(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    with pool.request("GET", f"{server}/close") as response:
+        response.read()
+    assert idle_count(pool) == 1
+
+    with pool.request("GET", f"{server}/file") as response:
+        assert response.status == 200
+        assert response.read() == b"x" * 1024
+
+    assert ports()[0] != ports()[-1]
+    assert idle_count(pool) == 1
+
+def test_unread_response_not_returned(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    with pool.request("GET", f"{server}/file") as response:
+        response.read(10)
+
+    assert idle_count(pool) == 0
+
+def test_exception_in_body_not_returned(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    with pytest.raises(ValueError):
+        with pool.request("GET", f"{server}/file"):
+            raise ValueError()
+
+    assert idle_count(pool) == 0
+
+def test_error_status_read_returned(server: str) -> None:
+    pool = HTTPConnectionPool()
+
+    with pool.request("GET", f"{server}/error") as response:
+        assert response.status == 500
+        assert response.read() == b"error"
+
+    assert idle_count(pool) == 1
+
+def test_connection_refused(server: str) -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    pool = HTTPConnectionPool()
+
+    with pytest.raises(OSError):
+        with pool.request("GET", f"http://127.0.0.1:{port}/file"):
+            pass
+
+    assert idle_count(pool) == 0
+
+def test_timeout_not_retried(server: str) -> None:
+    pool = HTTPConnectionPool()
+    with pool.request("GET", f"{server}/file") as response:
+        response.read()
+
+    with pytest.raises(TimeoutError):
+        with pool.request("GET", f"{server}/slow", timeout=0.2):
+            pass
+
+    assert [path for _, path in Handler.requests].count("/slow") == 1
+    assert idle_count(pool) == 0
+
+def test_timeout_restored(server: str) -> None:
+    pool = HTTPConnectionPool(timeout=5)
+
+    with pool.request("GET", f"{server}/file", timeout=1) as response:
+        response.read()
+
+    connection = pool._idle[("http", "127.0.0.1", int(server.rsplit(":", 1)[1]))][0]
+    assert connection.timeout == 5
+    assert connection.sock is not None and connection.sock.gettimeout() == 5
+
+def test_idle_connections_bounded(server: str) -> None:
+    pool = HTTPConnectionPool(size=1)
+    first = pool.request("GET", f"{server}/file")
+    second = pool.request("GET", f"{server}/file")
+
+    with first as response, second as other:
+        response.read()
+        other.read()
+
+    assert len(set(ports())) == 2
+    assert idle_count(pool) == 1
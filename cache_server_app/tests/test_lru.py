@@ -0,0 +1,163 @@
+#!/usr/bin/env python3.12
+"""
+test_lru
+
+Module created to test the thread-safe LRU cache.
+
+Author: Radim Mifka
+Date: 16.10.2026
+"""
+
+import threading
+
+import pytest
+
+import cache_server_app.src.lru as lru
+from cache_server_app.src.lru import LRUCache
+
+
+class Clock:
+    """Replacement for time.monotonic that only moves when told to."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(lru.time, "monotonic", clock)
+    return clock
+
+
+def test_get_missing() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+
+    assert cache.get("missing") is None
+
+def test_put_get() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+
+    assert cache.get("a") == "1"
+
+def test_evicts_least_recently_put() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.put("c", "3")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+    assert cache.get("c") == "3"
+
+def test_get_refreshes_entry() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+
+    assert cache.get("a") == "1"
+    assert cache.get("b") is None
+
+def test_put_replaces_and_refreshes_entry() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.put("a", "4")
+    cache.put("c", "3")
+
+    assert cache.get("a") == "4"
+    assert cache.get("b") is None
+
+def test_entry_expires_after_ttl(clock: Clock) -> None:
+    cache: LRUCache[str] = LRUCache(2, ttl=10)
+    cache.put("a", "1")
+
+    clock.now += 10
+    assert cache.get("a") == "1"
+
+    clock.now += 0.5
+    assert cache.get("a") is None
+
+def test_get_doesnt_extend_ttl(clock: Clock) -> None:
+    cache: LRUCache[str] = LRUCache(2, ttl=10)
+    cache.put("a", "1")
+
+    clock.now += 8
+    cache.get("a")
+    clock.now += 8
+
+    assert cache.get("a") is None
+
+def test_put_restarts_ttl(clock: Clock) -> None:
+    cache: LRUCache[str] = LRUCache(2, ttl=10)
+    cache.put("a", "1")
+
+    clock.now += 8
+    cache.put("a", "2")
+    clock.now += 8
+
+    assert cache.get("a") == "2"
+
+def test_no_ttl_never_expires(clock: Clock) -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+
+    clock.now += 10 ** 9
+    assert cache.get("a") == "1"
+
+def test_invalidate() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.invalidate("a")
+    cache.invalidate("missing")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+
+def test_clear() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.clear()
+
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+
+def test_tuple_keys() -> None:
+    cache: LRUCache[str] = LRUCache(2)
+    cache.put(("cache", "hash"), "1")
+
+    assert cache.get(("cache", "hash")) == "1"
+    assert cache.get(("other", "hash")) is None
+
+def test_concurrent_access_stays_bounded() -> None:
+    cache: LRUCache[int] = LRUCache(100)
+    errors: list[BaseException] = []
+
+    def worker(offset: int) -> None:
+        try:
+            for i in range(2000):
+                key = (offset + i) % 300
+                cache.put(key, key)
+                value = cache.get(key)
+                assert value is None or value == key
+                if i % 7 == 0:
+                    cache.invalidate((key + 1) % 300)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n * 37,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(cache._entries) <= 100
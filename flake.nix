@@ -43,6 +43,8 @@
             ed25519
             boto3
             pyyaml
+            orjson
+            uvloop
             mypy
             pytest
             types-pyyaml
@@ -16,7 +16,8 @@ setup(
         "cache_server_app/src/storage",
         "cache_server_app/src/storage/providers",
     ],
-    install_requires=["websockets", "pyjwt", "ed25519", 'boto3', 'pyyaml'],
+    install_requires=["websockets", "pyjwt", "ed25519", 'boto3', 'pyyaml', 'orjson'],
+    extras_require={"uvloop": ["uvloop"]},
     entry_points={
         "console_scripts": ["cache-server = cache_server_app.main:main"],
     },
@@ -14,6 +14,8 @@ let
     ed25519
     boto3
     pyyaml
+    orjson
+    uvloop
     mypy
     types-pyyaml
   ]);